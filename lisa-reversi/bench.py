@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Search benchmark.
+#
+# Runs the engine over the fixed positions of bench_positions.json,
+# which are split into sets by game phase, and reports per set the
+# nodes searched, nodes per second, time to reach each depth, the
+# effective branching factor and, against a baseline, how often the
+# best move agreed. Opening and midgame positions run Searcher.choose,
+# 20 empties Searcher.choose_final and 14 and 10 empties the exact
+# endgame Solver, each the way MainHandler.chooseMove would.
+#
+#   python bench.py                      # fixed depths
+#   python bench.py --time 1.5           # iterative deepening with a time limit
+#   python bench.py --save base.json     # store the results as a baseline
+#   python bench.py --baseline base.json # compare with a stored baseline
+#   python bench.py --generate bench_positions.json
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import bitboard
+import book
+import endgame
+import search
+from bitboard import popcount, squares
+
+POSITIONS_PATH = os.path.join(os.path.dirname(__file__), 'bench_positions.json')
+
+# (name, empty squares, search, fixed depth) of every set, in report
+# order. Empty squares are a range for the generator.
+SETS = [
+    ('opening', (46, 52), 'choose', 6),
+    ('midgame', (30, 40), 'choose', 5),
+    ('empty20', (20, 20), 'final', 7),
+    ('empty14', (14, 14), 'solve', None),
+    ('empty10', (10, 10), 'solve', None),
+]
+
+# Positions per set made by the generator.
+SET_SIZE = 8
+
+
+# Returns (move, score, nodes, [(depth, seconds, nodes)]) of one
+# position. Without a time limit every depth up to `depth` is
+# searched; with one, the iterations stop like in Searcher.deepen.
+def run_search(pos, kind, depth, limit):
+    searcher = search.Searcher()
+    empty = popcount(pos.empty())
+    if limit is not None:
+        depth = empty
+    deadline = float('inf') if limit is None else time.time() + limit
+    start = time.time()
+    iterations = []
+    result = None
+    for d in xrange(1, min(depth, empty) + 1):
+        root = pos.copy()
+        try:
+            if kind == 'final':
+                result = searcher.choose_final(root, d)
+            else:
+                result = searcher.choose(root, d)
+        except search.Timeout:
+            break
+        iterations.append((d, time.time() - start, searcher.nodes))
+        searcher.deadline = deadline
+        if time.time() > deadline:
+            break
+    point, move = result
+    return move, point, searcher.nodes, iterations
+
+
+# Like run_search for the exact endgame solver, whose one iteration is
+# the whole solve.
+def run_solve(pos, limit):
+    solver = endgame.Solver()
+    start = time.time()
+    deadline = float('inf') if limit is None else start + limit
+    solved = solver.solve(pos, deadline)
+    if solved is None:
+        return None, None, solver.nodes, []
+    point, move, exact = solved
+    iterations = [(popcount(pos.empty()), time.time() - start, solver.nodes)] if exact else []
+    return move, point, solver.nodes, iterations
+
+
+# Runs every set and returns {name: result}, where the result holds the
+# totals of the set and the move found for each position.
+def run(positions, limit=None):
+    results = {}
+    for name, empties, kind, depth in SETS:
+        boards = positions.get(name, [])
+        moves = []
+        nodes = 0
+        elapsed = 0.0
+        # depth -> [seconds], for the time to depth.
+        to_depth = {}
+        factors = []
+        for board in boards:
+            pos = bitboard.Position.from_pieces(board["Pieces"], board["Next"])
+            start = time.time()
+            if kind == 'solve':
+                move, point, n, iterations = run_solve(pos, limit)
+            else:
+                move, point, n, iterations = run_search(pos, kind, depth, limit)
+            elapsed += time.time() - start
+            nodes += n
+            moves.append(move)
+            for d, seconds, _ in iterations:
+                to_depth.setdefault(d, []).append(seconds)
+            # Effective branching factor: nodes of an iteration over
+            # those of the one before.
+            totals = [n for _, _, n in iterations]
+            counts = [after - before for before, after in zip([0] + totals, totals)]
+            factors.extend(float(b) / a for a, b in zip(counts, counts[1:]) if a)
+        results[name] = {
+            'positions': len(boards),
+            'nodes': nodes,
+            'seconds': elapsed,
+            'nps': nodes / elapsed if elapsed else 0.0,
+            'to_depth': dict((str(d), sum(s) / len(s)) for d, s in to_depth.iteritems()),
+            'branching': sum(factors) / len(factors) if factors else None,
+            'moves': moves,
+        }
+    return results
+
+
+# Returns the fraction of equal moves in two lists.
+def agreement(moves, baseline):
+    pairs = zip(moves, baseline)
+    if not pairs:
+        return None
+    return sum(1 for a, b in pairs if a == b) / float(len(pairs))
+
+
+def report(results, baseline=None, out=sys.stdout):
+    out.write('%-8s %4s %10s %8s %10s %6s %6s  %s\n' % (
+        'set', 'pos', 'nodes', 'seconds', 'nps', 'ebf', 'agree', 'time to depth'))
+    for name, _, _, _ in SETS:
+        r = results[name]
+        agree = ''
+        if baseline is not None and name in baseline:
+            a = agreement(r['moves'], baseline[name]['moves'])
+            agree = '%.2f' % a if a is not None else ''
+        to_depth = ' '.join('%s:%.2f' % (d, s) for d, s in sorted(r['to_depth'].iteritems(), key=lambda i: int(i[0])))
+        out.write('%-8s %4d %10d %8.2f %10.0f %6s %6s  %s\n' % (
+            name, r['positions'], r['nodes'], r['seconds'], r['nps'],
+            '%.2f' % r['branching'] if r['branching'] is not None else '', agree, to_depth))
+        if baseline is not None and name in baseline:
+            b = baseline[name]
+            out.write('%-8s %4s %+9.1f%% %+7.1f%% %+9.1f%%\n' % (
+                '', 'vs', change(r['nodes'], b['nodes']), change(r['seconds'], b['seconds']),
+                change(r['nps'], b['nps'])))
+
+
+# Returns the change from `before` to `after` in percent.
+def change(after, before):
+    if not before:
+        return 0.0
+    return 100.0 * (after - before) / before
+
+
+# Returns {name: [board]} of positions from random games, SET_SIZE per
+# set, the same for a given seed.
+def generate(seed=20161116):
+    rand = random.Random(seed)
+    positions = dict((name, []) for name, _, _, _ in SETS)
+    while any(len(boards) < SET_SIZE for boards in positions.itervalues()):
+        pos = book.initial_position()
+        # One position per set and game, at a random number of empty
+        # squares within the set's range.
+        wanted = dict((name, rand.randint(lo, hi)) for name, (lo, hi), _, _ in SETS)
+        while True:
+            moves = squares(pos.moves())
+            if not moves:
+                if not bitboard.move_mask(pos.discs[3 - pos.next], pos.discs[pos.next]):
+                    break
+                pos.pass_turn()
+                continue
+            empty = popcount(pos.empty())
+            for name, e in wanted.iteritems():
+                if e == empty and len(positions[name]) < SET_SIZE:
+                    positions[name].append({"Pieces": pos.pieces(), "Next": pos.next})
+            pos = pos.play(rand.choice(moves))
+    return positions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search benchmark.')
+    parser.add_argument('--positions', default=POSITIONS_PATH)
+    parser.add_argument('--time', type=float, help='seconds per position instead of fixed depths')
+    parser.add_argument('--baseline', help='results file to compare with')
+    parser.add_argument('--save', help='file to store the results in')
+    parser.add_argument('--generate', metavar='PATH', help='write a new position file and exit')
+    args = parser.parse_args()
+    if args.generate:
+        with open(args.generate, 'w') as f:
+            json.dump(generate(), f)
+        return
+    with open(args.positions) as f:
+        positions = json.load(f)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    results = run(positions, args.time)
+    report(results, baseline)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
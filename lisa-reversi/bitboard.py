@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Bitboard representation of the board.
+#
+# Each player's pieces are kept in one 64-bit integer. The square at
+# (x, y), 1-indexed like Game.Pos, is bit (y-1)*8 + (x-1), so A1 is
+# bit 0, H1 is bit 7 and H8 is bit 63.
+
+FULL = 0xFFFFFFFFFFFFFFFF
+# Masks that drop the pieces which wrapped around to the other edge
+# after shifting a board one column to the right (NOT_A) or to the
+# left (NOT_H).
+NOT_A = 0xFEFEFEFEFEFEFEFE
+NOT_H = 0x7F7F7F7F7F7F7F7F
+
+# The eight directions as (shift, mask). LEFT shifts move towards
+# bit 63 and RIGHT shifts towards bit 0.
+LEFT = [(1, NOT_A), (8, FULL), (9, NOT_A), (7, NOT_H)]
+RIGHT = [(1, NOT_H), (8, FULL), (9, NOT_H), (7, NOT_A)]
+
+
+# Returns the bit index for a 1-indexed (x, y) coordinate.
+def square(x, y):
+    return (y - 1) * 8 + (x - 1)
+
+
+# Returns the 1-indexed (x, y) coordinate of a bit index.
+def coord(sq):
+    return sq % 8 + 1, sq // 8 + 1
+
+
+# Returns the number of set bits.
+def popcount(b):
+    return bin(b).count('1')
+
+
+# Returns the squares of the set bits in ascending order.
+def squares(b):
+    result = []
+    while b:
+        low = b & -b
+        result.append(low.bit_length() - 1)
+        b ^= low
+    return result
+
+
+# Returns the final disc difference for the player owning `own` when
+# the game ends, with the empty squares going to the winner.
+def final_score(own, opp):
+    diff = popcount(own) - popcount(opp)
+    if diff > 0:
+        return 64 - 2 * popcount(opp)
+    if diff < 0:
+        return 2 * popcount(own) - 64
+    return 0
+
+
+# Returns the mask of legal moves for the player owning `own`.
+def move_mask(own, opp):
+    empty = ~(own | opp) & FULL
+    moves = 0
+    for shift, mask in LEFT:
+        o = opp & mask
+        t = (own << shift) & o
+        t |= (t << shift) & o
+        t |= (t << shift) & o
+        t |= (t << shift) & o
+        t |= (t << shift) & o
+        t |= (t << shift) & o
+        moves |= (t << shift) & mask & empty
+    for shift, mask in RIGHT:
+        o = opp & mask
+        t = (own >> shift) & o
+        t |= (t >> shift) & o
+        t |= (t >> shift) & o
+        t |= (t >> shift) & o
+        t |= (t >> shift) & o
+        t |= (t >> shift) & o
+        moves |= (t >> shift) & mask & empty
+    return moves
+
+
+# Returns the mask of opponent pieces flipped by playing at `sq`.
+# Returns 0 if the move captures nothing.
+def flip_mask(own, opp, sq):
+    flips = 0
+    start = 1 << sq
+    for shift, mask in LEFT:
+        f = 0
+        b = (start << shift) & mask
+        while b & opp:
+            f |= b
+            b = (b << shift) & mask
+        if b & own:
+            flips |= f
+    for shift, mask in RIGHT:
+        f = 0
+        b = (start >> shift) & mask
+        while b & opp:
+            f |= b
+            b = (b >> shift) & mask
+        if b & own:
+            flips |= f
+    return flips
+
+
+# Returns the mask of the 3x3 block centred on `sq`, clipped at the
+# edges of the board.
+def neighbour_mask(sq):
+    x, y = coord(sq)
+    mask = 0
+    for q in xrange(max(y - 1, 1), min(y + 2, 9)):
+        for p in xrange(max(x - 1, 1), min(x + 2, 9)):
+            mask |= 1 << square(p, q)
+    return mask
+
+NEIGHBOURS = [neighbour_mask(sq) for sq in xrange(64)]
+# The same without the centre square.
+ADJACENT = [NEIGHBOURS[sq] & ~(1 << sq) for sq in xrange(64)]
+
+
+# `planes` is a bit-sliced array of 64 4-bit counters: bit i of the
+# counter of square sq is bit sq of planes[i]. These add or subtract
+# one to the counter of every square in `mask`.
+def increment(planes, mask):
+    for i in xrange(4):
+        plane = planes[i]
+        planes[i] = plane ^ mask
+        mask &= plane
+        if not mask:
+            return
+
+
+def decrement(planes, mask):
+    for i in xrange(4):
+        plane = planes[i]
+        planes[i] = plane ^ mask
+        mask &= ~plane
+        if not mask:
+            return
+
+
+# A position as two bitboards plus the player who plays next.
+# discs[1] and discs[2] hold the pieces of player 1 and 2, so they
+# can be indexed by player number just like Game.Next().
+#
+# empty_around holds the number of empty squares next to each square
+# as bit-sliced counters, kept up to date by make_move and
+# unmake_move. So is `patterns`, if set, a patterns.PatternIndices.
+class Position(object):
+    __slots__ = ('discs', 'next', 'empty_around', 'patterns')
+
+    def __init__(self, p1, p2, next, empty_around=None, patterns=None):
+        self.discs = [0, p1, p2]
+        self.next = next
+        if empty_around is None:
+            empty_around = [0, 0, 0, 0]
+            for sq in squares(self.empty()):
+                increment(empty_around, ADJACENT[sq])
+        self.empty_around = empty_around
+        self.patterns = patterns
+
+    # Builds a position from the "Pieces" array of the JSON board.
+    @classmethod
+    def from_pieces(cls, pieces, next):
+        discs = [0, 0, 0]
+        for y, row in enumerate(pieces):
+            for x, piece in enumerate(row):
+                if piece:
+                    discs[piece] |= 1 << (y * 8 + x)
+        return cls(discs[1], discs[2], next)
+
+    def copy(self):
+        patterns = self.patterns.copy() if self.patterns is not None else None
+        return Position(self.discs[1], self.discs[2], self.next, self.empty_around[:], patterns)
+
+    # Returns the "Pieces" array of the JSON board.
+    def pieces(self):
+        p1, p2 = self.discs[1], self.discs[2]
+        return [[1 if p1 >> (y * 8 + x) & 1 else 2 if p2 >> (y * 8 + x) & 1 else 0
+                 for x in xrange(8)] for y in xrange(8)]
+
+    # Returns the mask of empty squares.
+    def empty(self):
+        return ~(self.discs[1] | self.discs[2]) & FULL
+
+    # Returns the mask of legal moves for the next player.
+    def moves(self):
+        return move_mask(self.discs[self.next], self.discs[3 - self.next])
+
+    # Returns the mask of pieces flipped by the next player at `sq`.
+    def flips(self, sq):
+        return flip_mask(self.discs[self.next], self.discs[3 - self.next], sq)
+
+    # Returns the total number of empty squares next to the pieces in
+    # `mask`.
+    def openness(self, mask):
+        planes = self.empty_around
+        return (popcount(mask & planes[0]) + 2 * popcount(mask & planes[1])
+                + 4 * popcount(mask & planes[2]) + 8 * popcount(mask & planes[3]))
+
+    # Returns the position after the next player plays at `sq`.
+    # The move must be legal.
+    def play(self, sq):
+        player = self.next
+        flips = self.flips(sq)
+        discs = self.discs[:]
+        discs[player] |= flips | (1 << sq)
+        discs[3 - player] &= ~flips
+        return Position(discs[1], discs[2], 3 - player)
+
+    # Plays the next player's move at `sq` in place and returns an
+    # undo record (sq, flipped pieces) for unmake_move. The move must
+    # be legal.
+    def make_move(self, sq):
+        player = self.next
+        discs = self.discs
+        flips = flip_mask(discs[player], discs[3 - player], sq)
+        discs[player] |= flips | (1 << sq)
+        discs[3 - player] &= ~flips
+        self.next = 3 - player
+        decrement(self.empty_around, ADJACENT[sq])
+        if self.patterns is not None:
+            self.patterns.play(player, sq, flips)
+        return sq, flips
+
+    # Passes the turn to the other player. Calling it again undoes it.
+    def pass_turn(self):
+        self.next = 3 - self.next
+
+    # Takes back the move recorded by make_move.
+    def unmake_move(self, undo):
+        sq, flips = undo
+        player = 3 - self.next
+        discs = self.discs
+        discs[player] &= ~(flips | (1 << sq))
+        discs[3 - player] |= flips
+        self.next = player
+        increment(self.empty_around, ADJACENT[sq])
+        if self.patterns is not None:
+            self.patterns.play(player, sq, flips, -1)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Opening book.
+#
+# The book maps positions to the move to play. Positions are stored as
+# the (own, opp) bitboards of the player to move, normalised over the
+# 8 symmetries of the board, so one entry covers every rotation and
+# reflection of a position.
+#
+# File format: the 4 byte magic "OBK1", then fixed size records of
+# own (uint64), opp (uint64) and move (uint8, a square of the stored
+# position), little endian and sorted by (own, opp). Lookups binary
+# search the memory-mapped file, so nothing is parsed at startup.
+#
+# To build a book:
+#   python book.py opening.book [plies] [depth]
+
+import struct
+import sys
+
+try:
+    import mmap
+except ImportError:
+    # Not every runtime allows mmap; the book is then read into memory.
+    mmap = None
+
+import bitboard
+from bitboard import FULL, squares
+
+MAGIC = 'OBK1'
+RECORD = struct.Struct('<QQB')
+KEY = struct.Struct('<QQ')
+
+
+def flip_vertical(b):
+    b = (b >> 8) & 0x00FF00FF00FF00FF | (b & 0x00FF00FF00FF00FF) << 8
+    b = (b >> 16) & 0x0000FFFF0000FFFF | (b & 0x0000FFFF0000FFFF) << 16
+    return b >> 32 | (b & 0xFFFFFFFF) << 32
+
+
+def mirror_horizontal(b):
+    b = (b >> 1) & 0x5555555555555555 | (b & 0x5555555555555555) << 1
+    b = (b >> 2) & 0x3333333333333333 | (b & 0x3333333333333333) << 2
+    return (b >> 4) & 0x0F0F0F0F0F0F0F0F | (b & 0x0F0F0F0F0F0F0F0F) << 4
+
+
+# Swaps x and y.
+def flip_diagonal(b):
+    t = 0x0F0F0F0F00000000 & (b ^ (b << 28))
+    b ^= t ^ (t >> 28)
+    t = 0x3333000033330000 & (b ^ (b << 14))
+    b ^= t ^ (t >> 14)
+    t = 0x5500550055005500 & (b ^ (b << 7))
+    b ^= t ^ (t >> 7)
+    return b & FULL
+
+
+# Applies symmetry `t` (0 to 7) to a bitboard: bit 0 mirrors
+# horizontally, bit 1 flips vertically and bit 2 swaps x and y, in
+# that order.
+def transform(b, t):
+    if t & 1:
+        b = mirror_horizontal(b)
+    if t & 2:
+        b = flip_vertical(b)
+    if t & 4:
+        b = flip_diagonal(b)
+    return b
+
+
+# Returns the table of the square that symmetry `t` moves to each
+# square.
+def untransform_table(t):
+    table = [0] * 64
+    for sq in xrange(64):
+        table[squares(transform(1 << sq, t))[0]] = sq
+    return table
+
+UNTRANSFORM = [untransform_table(t) for t in xrange(8)]
+
+
+# Returns (own, opp, t): the smallest of the 8 symmetric images of the
+# position and the symmetry that gives it.
+def canonical(own, opp):
+    best = None
+    for t in xrange(8):
+        image = (transform(own, t), transform(opp, t), t)
+        if best is None or image < best:
+            best = image
+    return best
+
+
+class OpeningBook(object):
+    def __init__(self, path):
+        f = open(path, 'rb')
+        try:
+            if mmap is not None:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.data = f.read()
+        finally:
+            f.close()
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not an opening book' % path)
+        self.size = (len(self.data) - len(MAGIC)) // RECORD.size
+
+    # Returns the book move of pos.next as a square, or None.
+    def lookup(self, pos):
+        own, opp, t = canonical(pos.discs[pos.next], pos.discs[3 - pos.next])
+        key = (own, opp)
+        data = self.data
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = len(MAGIC) + mid * RECORD.size
+            found = KEY.unpack_from(data, offset)
+            if found < key:
+                lo = mid + 1
+            elif found > key:
+                hi = mid
+            else:
+                return UNTRANSFORM[t][RECORD.unpack_from(data, offset)[2]]
+        return None
+
+
+# Writes {(own, opp): move} of canonical positions to a book file.
+def write_book(path, entries):
+    f = open(path, 'wb')
+    try:
+        f.write(MAGIC)
+        for (own, opp), move in sorted(entries.iteritems()):
+            f.write(RECORD.pack(own, opp, move))
+    finally:
+        f.close()
+
+
+# The starting position, player 1 to move.
+def initial_position():
+    return bitboard.Position(
+        1 << bitboard.square(5, 4) | 1 << bitboard.square(4, 5),
+        1 << bitboard.square(4, 4) | 1 << bitboard.square(5, 5), 1)
+
+
+# Returns the book entries for the first `plies` plies: for either
+# player, the move found by a `depth` ply search against every reply
+# of the opponent.
+def build(plies, depth):
+    import search
+    entries = {}
+    searcher = search.Searcher()
+    seen = set()
+
+    def expand(pos, ply, player):
+        if ply == plies or not pos.moves():
+            return
+        own, opp, t = canonical(pos.discs[pos.next], pos.discs[3 - pos.next])
+        if (own, opp, player) in seen:
+            return
+        seen.add((own, opp, player))
+        if pos.next == player:
+            if (own, opp) not in entries:
+                point, move, _ = searcher.deepen(pos, float('inf'), depth)
+                entries[(own, opp)] = squares(transform(1 << move, t))[0]
+            moves = [UNTRANSFORM[t][entries[(own, opp)]]]
+        else:
+            moves = squares(pos.moves())
+        for move in moves:
+            undo = pos.make_move(move)
+            expand(pos, ply + 1, player)
+            pos.unmake_move(undo)
+
+    for player in (1, 2):
+        expand(initial_position(), 0, player)
+    return entries
+
+
+if __name__ == '__main__':
+    path = sys.argv[1]
+    plies = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    depth = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    entries = build(plies, depth)
+    write_book(path, entries)
+    print '%d positions written to %s' % (len(entries), path)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Exact endgame solver.
+#
+# Searches to the end of the game and scores the final disc difference
+# with the empty squares given to the winner (bitboard.final_score).
+# It works on (own, opp) bitboard pairs of the player to move instead
+# of Position objects, since it does not need the evaluation state.
+
+import time
+
+from bitboard import FULL, final_score, flip_mask, move_mask, popcount, squares
+from search import CHECK_MASK, Timeout
+from transposition import EXACT, LOWER, UPPER, TranspositionTable, zobrist_pair
+
+# The four 4x4 quadrants of the board, the regions used for parity.
+QUADRANTS = [0x0F0F0F0F, 0xF0F0F0F0, 0x0F0F0F0F << 32, 0xF0F0F0F0 << 32]
+
+# Nodes with at most SMALL_EMPTIES empty squares are solved by
+# solve_small, which tries the empty squares directly instead of
+# generating moves.
+SMALL_EMPTIES = 4
+# Nodes with at least FASTEST_FIRST_EMPTIES empty squares order their
+# moves by the opponent's mobility; below that, by parity only.
+FASTEST_FIRST_EMPTIES = 7
+# Nodes with at least TABLE_EMPTIES empty squares use the
+# transposition table.
+TABLE_EMPTIES = 8
+
+
+# Returns the squares of `moves` (by default all of `empty`) with the
+# ones in quadrants holding an odd number of empty squares first.
+# Playing there tends to leave the last move of the region to us.
+def parity_order(empty, moves=None):
+    if moves is None:
+        moves = empty
+    odd = 0
+    for q in QUADRANTS:
+        if popcount(empty & q) & 1:
+            odd |= q
+    return squares(moves & odd) + squares(moves & ~odd)
+
+
+class Solver(object):
+    def __init__(self, table=None):
+        if table is None:
+            table = TranspositionTable()
+        self.table = table
+        # Number of nodes visited.
+        self.nodes = 0
+        # time.time() after which the search raises Timeout.
+        self.deadline = float('inf')
+
+    # Solves pos for pos.next, who must have a legal move. Returns
+    # (score, move, exact): with exact the score is the final disc
+    # difference, otherwise only its sign is known because the deadline
+    # passed after the win/loss/draw search. Returns None if even that
+    # did not finish.
+    def solve(self, pos, deadline):
+        self.deadline = deadline
+        own, opp = pos.discs[pos.next], pos.discs[3 - pos.next]
+        try:
+            try:
+                point, move = self.solve_root(own, opp, -1, 1)
+            except Timeout:
+                return None
+            if point == 0:
+                return 0, move, True
+            try:
+                if point > 0:
+                    return self.solve_root(own, opp, 0, 65) + (True,)
+                return self.solve_root(own, opp, -65, 0) + (True,)
+            except Timeout:
+                return point, move, False
+        finally:
+            self.deadline = float('inf')
+
+    # Returns (score, best move) of the root within (alpha, beta).
+    def solve_root(self, own, opp, alpha, beta):
+        empties = 64 - popcount(own | opp)
+        best_point = -65
+        best_move = None
+        for move, flips in self.ordered_moves(own, opp, empties, None):
+            point = -self.solve_node(opp ^ flips, own | flips | (1 << move),
+                                     -beta, -max(alpha, best_point), empties - 1)
+            if point > best_point:
+                best_point = point
+                best_move = move
+                if point >= beta:
+                    break
+        return best_point, best_move
+
+    # Returns [(move, flips)] of the player to move, best first.
+    def ordered_moves(self, own, opp, empties, hash_move):
+        moves = move_mask(own, opp)
+        if empties < FASTEST_FIRST_EMPTIES:
+            empty = ~(own | opp) & FULL
+            return [(sq, flip_mask(own, opp, sq)) for sq in parity_order(empty, moves)]
+        ranked = []
+        for sq in squares(moves):
+            flips = flip_mask(own, opp, sq)
+            if sq == hash_move:
+                rank = -1
+            else:
+                # Fastest first: leave the opponent as few moves as
+                # possible.
+                rank = popcount(move_mask(opp ^ flips, own | flips | (1 << sq)))
+            ranked.append((rank, sq, flips))
+        ranked.sort()
+        return [(sq, flips) for rank, sq, flips in ranked]
+
+    # Returns the score of (own, opp) within (alpha, beta) with
+    # `empties` empty squares. Principal variation search: the first
+    # move gets the full window and the others a null window, searched
+    # again only if they turn out better.
+    def solve_node(self, own, opp, alpha, beta, empties):
+        self.nodes += 1
+        if not self.nodes & CHECK_MASK and time.time() > self.deadline:
+            raise Timeout()
+        if empties <= SMALL_EMPTIES:
+            return self.solve_small(own, opp, alpha, beta, parity_order(~(own | opp) & FULL))
+
+        if not move_mask(own, opp):
+            if not move_mask(opp, own):
+                return final_score(own, opp)
+            return -self.solve_node(opp, own, -beta, -alpha, empties)
+
+        key = None
+        hash_move = None
+        if empties >= TABLE_EMPTIES:
+            key = zobrist_pair(own, opp)
+            entry = self.table.probe(key)
+            if entry is not None:
+                _, _, point, bound, hash_move = entry
+                if bound == EXACT or (bound == LOWER and point >= beta) or (bound == UPPER and point <= alpha):
+                    return point
+
+        best_point = -65
+        best_move = None
+        for move, flips in self.ordered_moves(own, opp, empties, hash_move):
+            child_own = opp ^ flips
+            child_opp = own | flips | (1 << move)
+            a = max(alpha, best_point)
+            if best_move is None:
+                point = -self.solve_node(child_own, child_opp, -beta, -a, empties - 1)
+            else:
+                point = -self.solve_node(child_own, child_opp, -a - 1, -a, empties - 1)
+                if a < point < beta:
+                    point = -self.solve_node(child_own, child_opp, -beta, -point, empties - 1)
+            if point > best_point:
+                best_point = point
+                best_move = move
+                if point >= beta:
+                    break
+
+        if key is not None:
+            if best_point <= alpha:
+                bound = UPPER
+            elif best_point >= beta:
+                bound = LOWER
+            else:
+                bound = EXACT
+            self.table.store(key, empties, best_point, bound, best_move)
+        return best_point
+
+    # solve_node for the last few empty squares, given in `empty` in
+    # parity order. A move is tried by computing its flips directly,
+    # which is cheaper than generating the move mask this close to the
+    # end of the game.
+    def solve_small(self, own, opp, alpha, beta, empty):
+        if len(empty) == 1:
+            return self.solve_last(own, opp, empty[0])
+        self.nodes += 1
+        best_point = -65
+        for sq in empty:
+            flips = flip_mask(own, opp, sq)
+            if not flips:
+                continue
+            rest = [e for e in empty if e != sq]
+            point = -self.solve_small(opp ^ flips, own | flips | (1 << sq),
+                                      -beta, -max(alpha, best_point), rest)
+            if point > best_point:
+                best_point = point
+                if point >= beta:
+                    return point
+        if best_point > -65:
+            return best_point
+        for sq in empty:
+            if flip_mask(opp, own, sq):
+                return -self.solve_small(opp, own, -beta, -alpha, empty)
+        return final_score(own, opp)
+
+    # solve_node for the very last empty square `sq`.
+    def solve_last(self, own, opp, sq):
+        self.nodes += 1
+        # Disc difference with the empty square not counted.
+        diff = 2 * popcount(own) - 63
+        flips = flip_mask(own, opp, sq)
+        if flips:
+            return diff + 2 * popcount(flips) + 1
+        flips = flip_mask(opp, own, sq)
+        if flips:
+            return diff - 2 * popcount(flips) - 1
+        if diff > 0:
+            return diff + 1
+        if diff < 0:
+            return diff - 1
+        return 0
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Table driven BOARD_2 evaluation of bitboards.
+#
+# A row of the board is a pattern of 8 squares each holding nothing,
+# our piece or theirs. ROW_POINTS[r] holds the BOARD_2 score of every
+# pattern of row r, indexed by own_byte | opp_byte << 8 where the bytes
+# are row r of each bitboard, so a board scores in 8 lookups.
+
+import numpy as np
+
+from bitboard import popcount
+
+BOARD_2 = np.array([[ 45, -11,  4, -1, -1,  4, -11,  45],
+                    [-11, -16, -1, -3, -3, -1, -16, -11],
+                    [  4,  -1,  2, -1, -1,  2,  -1,   4],
+                    [ -1,  -3, -1,  0,  0, -1,  -3,  -1],
+                    [ -1,  -3, -1,  0,  0, -1,  -3,  -1],
+                    [  4,  -1,  2, -1, -1,  2,  -1,   4],
+                    [-11, -16, -1, -3, -3, -1, -16, -11],
+                    [ 45, -11,  4, -1, -1,  4, -11,  45]])
+
+# BOARD_2 flattened so that it can be indexed by bitboard square.
+WEIGHTS_2 = BOARD_2.flatten().tolist()
+
+
+# Returns the ROW_POINTS table of one row of weights.
+def row_points(weights):
+    # byte_points[b] is the score of the pieces in byte b.
+    byte_points = [sum(w for bit, w in enumerate(weights) if b >> bit & 1) for b in xrange(256)]
+    return [own - opp for opp in byte_points for own in byte_points]
+
+ROW_POINTS = [row_points(row) for row in BOARD_2.tolist()]
+ROW_0, ROW_1, ROW_2, ROW_3, ROW_4, ROW_5, ROW_6, ROW_7 = ROW_POINTS
+
+
+# Returns the BOARD_2 score of `own` minus that of `opp`.
+def positional(own, opp):
+    return (ROW_0[own & 0xFF | (opp & 0xFF) << 8]
+            + ROW_1[own >> 8 & 0xFF | opp & 0xFF00]
+            + ROW_2[own >> 16 & 0xFF | opp >> 8 & 0xFF00]
+            + ROW_3[own >> 24 & 0xFF | opp >> 16 & 0xFF00]
+            + ROW_4[own >> 32 & 0xFF | opp >> 24 & 0xFF00]
+            + ROW_5[own >> 40 & 0xFF | opp >> 32 & 0xFF00]
+            + ROW_6[own >> 48 & 0xFF | opp >> 40 & 0xFF00]
+            + ROW_7[own >> 56 & 0xFF | opp >> 48 & 0xFF00])
+
+
+# Returns the positional score plus mobility of the player to move.
+# `moves` is the legal move mask of the position, which the caller
+# usually has already.
+def calculate_point(pos, moves):
+    player = pos.next
+    return positional(pos.discs[player], pos.discs[3 - player]) + popcount(moves)
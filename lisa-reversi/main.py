@@ -2,32 +2,100 @@
 # -*- coding: utf-8 -*-
 
 import copy
+import functools
 import json
 import logging
-import random
 import webapp2
-import numpy as np
-import signal
+import os
 import time
 
-BOARD = np.array([[ 30, -12,   0,  -1,  -1,   0, -12,  30],
-                  [-12, -15,  -3,  -3,  -3,  -3, -15, -12],
-                  [  0,  -3,   0,  -1,  -1,   0,  -3,   0],
-                  [ -1,  -3,  -1,  -1,  -1,  -1,  -3,  -1],
-                  [ -1,  -3,  -1,  -1,  -1,  -1,  -3,  -1],
-                  [  0,  -3,   0,  -1,  -1,   0,  -3,   0],
-                  [-12, -15,  -3,  -3,  -3,  -3, -15, -12],
-                  [ 30, -12,   0,  -1,  -1,   0, -12,  30]])
-BOARD_2 = np.array([[ 45, -11,  4, -1, -1,  4, -11,  45],
-                    [-11, -16, -1, -3, -3, -1, -16, -11],
-                    [  4,  -1,  2, -1, -1,  2,  -1,   4],
-                    [ -1,  -3, -1,  0,  0, -1,  -3,  -1],
-                    [ -1,  -3, -1,  0,  0, -1,  -3,  -1],
-                    [  4,  -1,  2, -1, -1,  2,  -1,   4],
-                    [-11, -16, -1, -3, -3, -1, -16, -11],
-                    [ 45, -11,  4, -1, -1,  4, -11,  45]])
-
-BOARD_FIN = np.ones((8,8))
+import bitboard
+import book
+import endgame
+import multiboard
+import patterns
+import ponder
+import results
+import sampler
+import search
+import session
+import stats
+from bitboard import popcount, squares
+
+# Seconds pickMove2 may spend searching. Iterative deepening stops at
+# the first depth that does not finish in time.
+TIME_BUDGET = 1.5
+
+# From this many empty squares down the game is solved exactly, with
+# SOLVE_SHARE of the time budget. If the solver runs out of time the
+# rest goes to the heuristic search.
+SOLVE_EMPTIES = 14
+SOLVE_SHARE = 2.0 / 3
+
+# The opening book is memory-mapped once per instance. Build it with
+# `python book.py opening.book`.
+BOOK_PATH = os.path.join(os.path.dirname(__file__), 'opening.book')
+BOOK = book.OpeningBook(BOOK_PATH) if os.path.exists(BOOK_PATH) else None
+
+# SEARCH_PROCESSES, PONDER_TIME and RESULT_PATH are off by default: the
+# App Engine standard environment cannot start processes, keep threads
+# running past a request or write files, so they are for running the
+# handler elsewhere.
+
+# Number of worker processes the heuristic search splits its root moves
+# over, or 0 to search in the request's thread only. With SHARED_SEARCH
+# the processes instead all search the whole tree over a shared
+# transposition table, which helps more when there are few moves to
+# split. parallel is only imported when they are used, as it needs
+# ctypes.
+SEARCH_PROCESSES = 0
+SHARED_SEARCH = False
+if SEARCH_PROCESSES:
+        import parallel
+
+# Seconds to keep searching the opponent's replies after answering, or
+# 0 not to. Only positions with at least PONDER_EMPTIES empty squares
+# are pondered, and a pondered search counts as a hit from
+# PONDER_DEPTH plies.
+PONDER_TIME = 0
+PONDER_EMPTIES = 25
+PONDER_DEPTH = 7
+
+# Moves searched for earlier requests are played again when the same
+# position, or a symmetric one, comes back, if their search was as deep
+# as the one it would get now. Up to RESULT_ENTRIES are kept in memory,
+# and if RESULT_PATH is set all of them in a file that survives
+# restarts.
+RESULT_ENTRIES = 1 << 16
+RESULT_PATH = None
+RESULTS = results.ResultCache(RESULT_ENTRIES, RESULT_PATH)
+
+# With SEARCH_STATS the searches count what they do, and GET /?stats=1
+# returns the counts of the latest move as JSON. Off, the search runs
+# without any counting.
+SEARCH_STATS = False
+LAST_STATS = {}
+
+# Weights of the pattern evaluation, which replaces BOARD_2 when the
+# file exists. Build it with `python patterns.py patterns.weights` or
+# by training.
+PATTERNS_PATH = os.path.join(os.path.dirname(__file__), 'patterns.weights')
+EVALUATOR = patterns.PatternEvaluator.load(PATTERNS_PATH) if os.path.exists(PATTERNS_PATH) else None
+
+# Makes the Searcher of a game.
+SEARCHER_FACTORY = functools.partial(stats.InstrumentedSearcher if SEARCH_STATS else search.Searcher,
+                                     evaluator=EVALUATOR)
+
+PONDERER = ponder.Ponderer()
+
+# Collapsed stacks of the latest profiled move, see
+# MainHandler.pickMoveProfiled.
+LAST_PROFILE = ['']
+
+# Searches of earlier moves are kept per game, up to SESSION_MEMORY
+# bytes for all games of the instance.
+SESSION_MEMORY = 128 << 20
+SESSIONS = session.SessionCache(SESSION_MEMORY, SEARCHER_FACTORY)
 
 # Reads json description of the board and provides simple interface.
 class Game:
@@ -49,20 +117,26 @@ class Game:
 	def Next(self):
 		return self._board["Next"]
 
+	# Returns the board as a bitboard.Position.
+	def Bitboard(self):
+		return bitboard.Position.from_pieces(self._board["Pieces"], self.Next())
+
 	# Returns the array of valid moves for next player.
 	# Each move is a dict
 	#   "Where": [x,y]
 	#   "As": player number
 	def ValidMoves(self):
-                moves = []
-                for y in xrange(1,9):
-                        for x in xrange(1,9):
-                                move = {"Where": [x,y],
-                                        "As": self.Next()}
-                                if self.NextBoardPosition(move):
-                                        moves.append(move)
-                return moves
-                                
+		moves = []
+		for sq in squares(self.MoveMask()):
+			x, y = bitboard.coord(sq)
+			moves.append({"Where": [x,y],
+				      "As": self.Next()})
+		return moves
+
+	# Returns the valid moves for next player as a bitboard mask.
+	# Unlike NextBoardPosition this does not build any boards.
+	def MoveMask(self):
+		return self.Bitboard().moves()
 
 	# Helper function of NextBoardPosition.  It looks towards
 	# (delta_x, delta_y) direction for one of our own pieces and
@@ -147,9 +221,12 @@ def PrettyMove(move):
 	m = move["Where"]
 	return '%s%d' % (chr(ord('A') + m[0] - 1), m[1])
 
-def signal_handler(signum, frame):
-        raise Exception('time out')
-                
+# PrettyMove of a move given as a bitboard square, which is how the
+# search passes moves around.
+def PrettySquare(sq):
+	x, y = bitboard.coord(sq)
+	return '%s%d' % (chr(ord('A') + x - 1), y)
+
 class MainHandler(webapp2.RequestHandler):
     # Handling GET request, just for debugging purposes.
     # If you open this handler directly, it will show you the
@@ -157,6 +234,14 @@ class MainHandler(webapp2.RequestHandler):
     # here for testing.
 
     def get(self):
+        if self.request.get('stats'):
+          self.response.content_type = 'application/json'
+          self.response.write(json.dumps(LAST_STATS))
+          return
+        if self.request.get('profile_report'):
+          self.response.content_type = 'text/plain'
+          self.response.write(LAST_PROFILE[0])
+          return
         if not self.request.get('json'):
           self.response.write("""
 <body><form method=get>
@@ -168,209 +253,176 @@ Paste JSON here:<p/><textarea name=json cols=80 rows=24></textarea>
           return
         else:
           g = Game(self.request.get('json'))
-          self.pickMove2(g)
+          self.pickMoveProfiled(g)
 
     def post(self):
     	# Reads JSON representation of the board and store as the object.
     	g = Game(self.request.body)
         # Do the picking of a move and print the result.
-        self.pickMove2(g)
+        self.pickMoveProfiled(g)
+
+    # pickMove2, under the sampling profiler if the request has a
+    # "profile" parameter or an X-Profile header. The report, collapsed
+    # stacks for flame graph tools, is served by GET /?profile_report=1.
+    def pickMoveProfiled(self, g):
+        if not (self.request.get('profile') or self.request.headers.get('X-Profile')):
+                self.pickMove2(g)
+                return
+        profiler = sampler.Sampler()
+        profiler.start()
+        try:
+                self.pickMove2(g)
+        finally:
+                profiler.stop()
+        LAST_PROFILE[0] = profiler.collapsed()
+        logging.info("profiled, %d stacks", len(profiler.counts))
 
     def pickMove2(self, g):
-    	# Gets all valid moves.
-    	valid_moves = g.ValidMoves()
         start = time.time()
-    	if len(valid_moves) == 0:
-    		# Passes if no valid moves.
-    		self.response.write("PASS")
-    	else:
-                self.empty = np.sum([[1 if g.Pos(x, y) == 0 else 0 for x in xrange(1,9)] for y in xrange(1,9)])
-                self.best_point = {1:{}, 2:{}, 3:{}, 4:{}, 5:{}, 6:{}, 7:{}, 8:{}, 9:{}, 10:{}, 11:{}, 12:{}, 13:{}, 14:{}}
-                self.threshold0 = 13
-                self.threshold1 = 16
-                self.threshold2 = 24
-                if self.empty < self.threshold0:
-                        result = self.choose_final(g, min(6, self.empty), g.Next(), [0])
-                elif self.empty < self.threshold1:
-                        result = self.choose_final(g, 4, g.Next(), [0])
-                elif self.empty < self.threshold2:
-                        result = self.choose_final(g, 3, g.Next(), [0])
-                else:
-                        if len(g.ValidMoves()) < 7:
-                                result = self.choose(g, 3, g.Next(), [0])
-                        else:
-                                result = self.choose(g, 2, g.Next(), [0])
-    		move = result['best_move']
-                self.response.write(PrettyMove(move))
+        pos = g.Bitboard()
+        # Gets all valid moves as a bitboard mask.
+        valid_moves = pos.moves()
+        if not valid_moves:
+                # Passes if no valid moves.
+                self.response.write("PASS")
+        else:
+                game = SESSIONS.take(pos)
+                expected = game.expected_move(pos)
+                logging.info("session pv%s, expected %s", game.pv, expected)
+                searcher = game.searcher
+                pondering = PONDER_TIME > 0 and PONDERER.acquire()
+                if SEARCH_STATS:
+                        searcher.stats.clear()
+                        solver_nodes = game.solver.nodes
+                best_move = None
+                try:
+                        # Tried first at the root when the table has no
+                        # move for pos.
+                        searcher.orderer.root_move = expected
+                        best_move, point, kind = self.chooseMove(pos, start, TIME_BUDGET, searcher, game.solver,
+                                                                 PONDERER if pondering else None)
+                        # Before pondering searches with it again.
+                        game.pv = searcher.principal_variation(pos.play(best_move))
+                        if SEARCH_STATS:
+                                LAST_STATS.clear()
+                                LAST_STATS.update(searcher.stats.as_dict())
+                                LAST_STATS["solver_nodes"] = game.solver.nodes - solver_nodes
+                                LAST_STATS["seconds"] = time.time() - start
+                finally:
+                        searcher.orderer.root_move = None
+                        if pondering:
+                                after = None
+                                if best_move is not None and popcount(pos.empty()) > PONDER_EMPTIES:
+                                        after = pos.play(best_move)
+                                PONDERER.release(after, PONDER_TIME, searcher)
+                SESSIONS.put(game, pos.play(best_move))
+                self.response.write(PrettySquare(best_move))
         elapsed_time = time.time()-start
         logging.info(elapsed_time)
 
-    def choose(self, g, depth, next, index, open_point=0):
-        validmove = g.ValidMoves()
-        if depth == 0:
-            final_open = 0
-            if validmove:
-                    for move in validmove:
-                            open = self.calculateOpenness(g, g.NextBoardPosition(move))
-                            if open < final_open:
-                                    final_open = open
-            if g.Next() != next:
-                    final_open *= -1
-            logging.info("open_point%d, final_open%d", open_point, final_open)
-            return {'point': self.calculatePoint(g, next) + 3*(open_point + final_open), 'best_move': None}
-        
-        if not validmove:
-            if g.Next() == next:
-                return {'point': 100, 'best_move': None}
-            else:
-                return {'point': -100, 'best_move': None}
-        
-        best_move = random.choice(validmove)
-        if g.Next() == next: # next is me 
-            point = -100
-            for i, move in enumerate(validmove):
-                new_index = [i] + index 
-                g_next = g.NextBoardPosition(move)
-                openness = self.calculateOpenness(g, g_next)
-                result = self.choose(g_next, depth - 1, next, new_index, open_point + openness)
-                logging.info(move)
-                logging.info("result%d, depth%d", result['point'], depth)
-                self.best_point[depth-1] = {}
-                if not self.best_point[depth].has_key(new_index[1]):
-                        self.best_point[depth][new_index[1]] = result['point']
-                if len(new_index) > 2:
-                        if self.best_point[depth + 1].has_key(new_index[2]):
-                                if result['point'] > self.best_point[depth+1][new_index[2]]:
-                                        #logging.info("cut")
-                                        #self.best_point[depth][new_index[1]] = result['point']
-                                        point = result['point']
-                                        best_move = move
-                                        break
-                if result['point'] > point:
-                        point = result['point']
-                        best_move = move
-                        self.best_point[depth][new_index[1]] = result['point']
-                #logging.info("point%d, depth%d", point, depth)
-                #logging.info(self.best_point)
-                        
-        elif g.Next() != next: # next is enemy
-            point = 100
-            for i, move in enumerate(validmove):
-                new_index = [i] + index
-                #logging.info(new_index)
-                g_next = g.NextBoardPosition(move)
-                openness = self.calculateOpenness(g, g_next)
-                result = self.choose(g_next, depth - 1, next, new_index, open_point - openness)
-                logging.info(move)
-                logging.info("result%d, depth%d", result['point'], depth)
-                #logging.info("point%d", result['point'])
-                self.best_point[depth-1] = {}
-                if not self.best_point[depth].has_key(new_index[1]):
-                        self.best_point[depth][new_index[1]] = result['point']
-                if len(new_index) > 2:
-                        if self.best_point[depth + 1].has_key(new_index[2]):
-                                if result['point'] < self.best_point[depth+1][new_index[2]]:
-                                        logging.info("short")
-                                        point = result['point']
-                                        best_move = move
-                                        #self.best_point[depth][new_index[1]] = result['point']
-                                        break
-                if result['point'] < point:
-                    point = result['point']
-                    best_move = move
-                    self.best_point[depth][new_index[1]] = result['point']
-                #logging.info("point%d, depth%d", point, depth)
-                #logging.info(self.best_point)
-        return {'point': point, 'best_move': best_move}
-
-    def choose_final(self, g, depth, next, index):
-        validmove = g.ValidMoves()
-        #logging.info(validmove)
-        if depth == 0:
-                logging.info(next==g.Next())
-                if self.empty < self.threshold0:
-                        board_me = np.array([[1 if g.Pos(x, y) == next else 0 for x in xrange(1,9)] for y in xrange(1,9)])
-                        board_enemy = np.array([[1 if g.Pos(x, y) not in [next, 0] else 0 for x in xrange(1,9)] for y in xrange(1,9)])
-                        point = np.sum(board_me * BOARD_FIN) - np.sum(board_enemy * BOARD_FIN)
-                else:
-                        point = self.calculatePoint(g, next)
-                logging.info(point)
-                return {'point': point, 'best_move': None}
-        
-        if not validmove:
-            if g.Next() == next:
-                return {'point': 100, 'best_move': None}
-            else:
-                return {'point': -100, 'best_move': None}
-        
-        best_move = random.choice(validmove)
-        if g.Next() == next: # next is me 
-            point = -100
-            for i, move in enumerate(validmove):
-                new_index = [i] + index 
-                g_next = g.NextBoardPosition(move)
-                result = self.choose_final(g_next, depth - 1, next, new_index)
-                self.best_point[depth-1] = {}
-                if not self.best_point[depth].has_key(new_index[1]):
-                        self.best_point[depth][new_index[1]] = result['point']
-                if len(new_index) > 2:
-                        if self.best_point[depth + 1].has_key(new_index[2]):
-                                if result['point'] > self.best_point[depth+1][new_index[2]]:
-                                        logging.info("cut")
-                                        point = result['point']
-                                        best_move = move
-                                        break
-                if result['point'] > point:
-                        point = result['point']
-                        best_move = move
-                        self.best_point[depth][new_index[1]] = result['point']
-
-        elif g.Next() != next: # next is enemy
-            point = 100
-            for i, move in enumerate(validmove):
-                new_index = [i] + index
-                g_next = g.NextBoardPosition(move)
-                result = self.choose_final(g_next, depth - 1, next, new_index)
-                self.best_point[depth-1] = {}
-                if not self.best_point[depth].has_key(new_index[1]):
-                        self.best_point[depth][new_index[1]] = result['point']
-                if len(new_index) > 2:
-                        if self.best_point[depth + 1].has_key(new_index[2]):
-                                if result['point'] < self.best_point[depth+1][new_index[2]]:
-                                        logging.info("short")
-                                        point = result['point']
-                                        best_move = move
-                                        break
-                if result['point'] < point:
-                    point = result['point']
-                    best_move = move
-                    self.best_point[depth][new_index[1]] = result['point']
-        return {'point': point, 'best_move': best_move}
-
-
-    def calculatePoint(self, h, next):
-        # more is better
-        #logging.info(next==h.Next())
-        board_me = np.array([[1 if h.Pos(x, y) == next else 0 for x in xrange(1,9)] for y in xrange(1,9)])
-        board_enemy = np.array([[1 if h.Pos(x, y) not in [next, 0] else 0 for x in xrange(1,9)] for y in xrange(1,9)])
-        point = np.sum(board_me * BOARD_2) - np.sum(board_enemy * BOARD_2)
-        logging.info("calculate%d", point)
-        if h.Next() == next:
-                point += len(h.ValidMoves())
+    # Returns (square, score, kind) of the move to play in pos, which
+    # must have a valid move, searching until start + budget. The kind
+    # says what the score is:
+    #   "book"  a book move, the score is None
+    #   "exact" the exact final disc difference, from the solver
+    #   "bound" a final disc difference the solver only proved a bound
+    #           of, with the right sign
+    #   "discs" a search scoring leaves by disc difference
+    #   "eval"  a search scoring leaves by evaluation points
+    # The searches score finished games as the final disc difference
+    # times search.GAME_OVER. searcher and solver may be shared between
+    # calls to reuse their transposition tables. A ponderer's results
+    # are used when they are deep enough, and so are those of RESULTS.
+    def chooseMove(self, pos, start, budget, searcher, solver, ponderer=None):
+        valid_moves = pos.moves()
+        empty = popcount(pos.empty())
+        # Below threshold0 empty squares leaves are scored by
+        # disc count, below threshold2 openness is ignored.
+        threshold0 = 13
+        threshold2 = 24
+        deadline = start + budget
+        if BOOK is not None:
+                best_move = BOOK.lookup(pos)
+                if best_move is not None and valid_moves >> best_move & 1:
+                        logging.info("book move")
+                        return best_move, None, "book"
+        # Solvable positions need an exact result, others one as deep as
+        # the latest search with as many empty squares in as much time.
+        if empty <= SOLVE_EMPTIES:
+                cached = RESULTS.lookup(pos, exact=True)
         else:
-                point -= len(h.ValidMoves())
-        logging.info("len%d", len(h.ValidMoves()))
-        return point
-
-    def calculateOpenness(self, h, h_next):
-        change_list = [[x, y] if h.Pos(x, y) != h_next.Pos(x, y) and h.Pos(x, y) != 0 else [] for x in range(1, 9) for y in range(1, 9)]
-        change_list = filter(lambda s:s != [], change_list)
-        openness = 0
-        for change in change_list:
-                x, y = change
-                openness += np.sum([1 if h.Pos(p, q) == 0 else 0 for p in xrange(max(x-1, 1), min(x+2, 9)) for q in xrange(max(y-1, 1), min(y+2, 9))])
-        return openness * (-1)
-                
+                cached = RESULTS.lookup(pos, RESULTS.expected_depth(empty, budget))
+        if cached is not None and valid_moves >> cached[0] & 1:
+                logging.info("cached move, depth%d", cached[2])
+                # Inexact entries are only used above SOLVE_EMPTIES, where
+                # the search scores by evaluation.
+                return cached[0], cached[1], "exact" if cached[3] else "eval"
+        if ponderer is not None:
+                pondered = ponderer.lookup(pos)
+                if pondered is not None and pondered[2] >= PONDER_DEPTH:
+                        logging.info("ponder hit, depth%d", pondered[2])
+                        return pondered[0], pondered[1], "eval"
+        if empty <= SOLVE_EMPTIES:
+                solved = solver.solve(pos, start + SOLVE_SHARE * budget)
+                logging.info("solved%s, nodes%d", solved, solver.nodes)
+                if solved is not None:
+                        point, best_move, exact = solved
+                        RESULTS.store(pos, best_move, point, empty, exact)
+                        return best_move, point, "exact" if exact else "bound"
+        deepen = searcher.deepen
+        if SEARCH_PROCESSES and SHARED_SEARCH:
+                deepen = functools.partial(parallel.deepen_shared, SEARCH_PROCESSES, evaluator=EVALUATOR)
+        elif SEARCH_PROCESSES:
+                deepen = functools.partial(parallel.deepen, searcher, SEARCH_PROCESSES)
+        if empty < threshold0:
+                point, best_move, depth = deepen(pos, deadline, empty, final=True, count_discs=True)
+        elif empty < threshold2:
+                point, best_move, depth = deepen(pos, deadline, empty, final=True)
+        else:
+                point, best_move, depth = deepen(pos, deadline, empty)
+        logging.info("point%d, depth%d, nodes%d", point, depth, searcher.nodes)
+        RESULTS.store(pos, best_move, point, depth, budget=budget)
+        return best_move, point, "discs" if empty < threshold0 else "eval"
+
+
+# Picks moves for many positions in one request, for offline analysis
+# and self-play. The body is either a JSON array or one JSON value per
+# line; each value is a game like the body of MainHandler.post, or just
+# its "board". The response has one {"move": ..., "score": ...,
+# "kind": ...} per position, in the same format as the request, where
+# the kind tells the units of the score as in MainHandler.chooseMove;
+# a position that must pass has kind "pass" and no score. Scores of
+# different kinds cannot be compared. All positions share one
+# Searcher and Solver and so their transposition tables. The optional
+# "budget" parameter is the search time per position in seconds.
+class BatchHandler(MainHandler):
+    def post(self):
+        body = self.request.body.strip()
+        if body.startswith('['):
+                games = json.loads(body)
+        else:
+                games = [json.loads(line) for line in body.splitlines() if line.strip()]
+        budget = float(self.request.get('budget', TIME_BUDGET))
+        searcher = SEARCHER_FACTORY()
+        solver = endgame.Solver()
+        positions = [Game(board=game.get("board", game)).Bitboard() for game in games]
+        # The positions that must pass, found for all of them at once.
+        own, opp = multiboard.from_positions(positions)
+        passing = (multiboard.move_masks(own, opp) == 0).tolist()
+        answers = []
+        for pos, stuck in zip(positions, passing):
+                if stuck:
+                        answers.append({"move": "PASS", "score": None, "kind": "pass"})
+                        continue
+                best_move, point, kind = self.chooseMove(pos, time.time(), budget, searcher, solver)
+                answers.append({"move": PrettySquare(best_move), "score": point, "kind": kind})
+        self.response.content_type = 'application/json'
+        if body.startswith('['):
+                self.response.write(json.dumps(answers))
+        else:
+                self.response.write(''.join(json.dumps(answer) + '\n' for answer in answers))
+
 app = webapp2.WSGIApplication([
-    ('/', MainHandler)
+    ('/', MainHandler),
+    ('/batch', BatchHandler),
 ], debug=True)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Move generation on many boards at once.
+#
+# The functions here work on numpy uint64 arrays of bitboards, one
+# element per board, in the layout of bitboard.py. They do the shifts
+# and masks of bitboard.move_mask and flip_mask on every board at once,
+# so thousands of games can be advanced in lockstep with a few numpy
+# calls per ply instead of a Python loop per board. Boards are passed
+# as (own, opp) arrays of the player to move.
+#
+# Counts the leaves of the game tree, a check of the move generator:
+#   python multiboard.py perft 8
+# Writes random games in the record format of train.py:
+#   python multiboard.py games 100000 games.txt [seed]
+
+import sys
+
+import numpy as np
+
+import bitboard
+import book
+
+U64 = np.uint64
+ZERO = U64(0)
+ONE = U64(1)
+# bitboard.LEFT and RIGHT as numpy scalars. Shifting a uint64 array by
+# a Python int would turn it into floats.
+LEFT = [(U64(shift), U64(mask)) for shift, mask in bitboard.LEFT]
+RIGHT = [(U64(shift), U64(mask)) for shift, mask in bitboard.RIGHT]
+SQUARES = np.arange(64, dtype=np.uint64)
+
+# Boards per expand call in perft, and games played at once by the
+# games command, to bound memory.
+PERFT_BOARDS = 1 << 20
+GAME_BOARDS = 1 << 16
+
+
+# Returns the (own, opp) arrays of the player to move of a list of
+# bitboard.Position.
+def from_positions(positions):
+    own = np.array([pos.discs[pos.next] for pos in positions], dtype=np.uint64)
+    opp = np.array([pos.discs[3 - pos.next] for pos in positions], dtype=np.uint64)
+    return own, opp
+
+
+# Returns the (own, opp) arrays of n starting positions.
+def initial_boards(n):
+    own, opp = from_positions([book.initial_position()])
+    return own.repeat(n), opp.repeat(n)
+
+
+# Returns the number of set bits of every board.
+def popcounts(b):
+    b = b - ((b >> ONE) & U64(0x5555555555555555))
+    b = (b & U64(0x3333333333333333)) + ((b >> U64(2)) & U64(0x3333333333333333))
+    b = (b + (b >> U64(4))) & U64(0x0F0F0F0F0F0F0F0F)
+    return ((b * U64(0x0101010101010101)) >> U64(56)).astype(np.int32)
+
+
+# Returns the (N, 64) array of the bits of every board, square 0 first.
+def square_bits(b):
+    return ((b[:, np.newaxis] >> SQUARES) & ONE).astype(np.uint8)
+
+
+# Returns the masks of legal moves, like bitboard.move_mask.
+def move_masks(own, opp):
+    empty = ~(own | opp)
+    moves = np.zeros(len(own), dtype=np.uint64)
+    for shift, mask in LEFT:
+        o = opp & mask
+        t = (own << shift) & o
+        for i in xrange(5):
+            t |= (t << shift) & o
+        moves |= (t << shift) & mask & empty
+    for shift, mask in RIGHT:
+        o = opp & mask
+        t = (own >> shift) & o
+        for i in xrange(5):
+            t |= (t >> shift) & o
+        moves |= (t >> shift) & mask & empty
+    return moves
+
+
+# Returns the masks of opponent pieces flipped by playing at the
+# squares `sq`, one per board, like bitboard.flip_mask.
+def flip_masks(own, opp, sq):
+    start = ONE << np.asarray(sq).astype(np.uint64)
+    flips = np.zeros(len(own), dtype=np.uint64)
+    # A run of opponent pieces from the move flips if one of our own
+    # pieces closes it.
+    for shift, mask in LEFT:
+        o = opp & mask
+        f = (start << shift) & o
+        for i in xrange(5):
+            f |= (f << shift) & o
+        flips |= np.where((f << shift) & mask & own, f, ZERO)
+    for shift, mask in RIGHT:
+        o = opp & mask
+        f = (start >> shift) & o
+        for i in xrange(5):
+            f |= (f >> shift) & o
+        flips |= np.where((f >> shift) & mask & own, f, ZERO)
+    return flips
+
+
+# Plays the legal moves at the squares `sq`, one per board, and returns
+# the (own, opp) arrays of the boards after them, for the other player.
+def play(own, opp, sq):
+    flips = flip_masks(own, opp, sq)
+    placed = ONE << np.asarray(sq).astype(np.uint64)
+    return opp & ~flips, own | flips | placed
+
+
+# Returns (boards, squares): the index of the board and the square of
+# every legal move in `moves`, ordered by board.
+def move_squares(moves):
+    boards, sq = np.nonzero(square_bits(moves))
+    return boards, sq
+
+
+# Returns one legal move per board, picked at random by `rand`, a
+# numpy.random.RandomState; -1 for boards without moves.
+def random_moves(moves, rand):
+    bits = square_bits(moves)
+    sq = (rand.random_sample(bits.shape) * bits).argmax(axis=1)
+    sq[moves == 0] = -1
+    return sq
+
+
+# Returns (own, opp, finished): the boards after every legal move of
+# every board, then those of the boards that must pass, and the number
+# of boards where the game is over.
+def expand(own, opp):
+    moves = move_masks(own, opp)
+    boards, sq = move_squares(moves)
+    child_own, child_opp = play(own[boards], opp[boards], sq)
+    stuck = moves == 0
+    passing = stuck & (move_masks(opp, own) != 0)
+    return (np.concatenate([child_own, opp[passing]]),
+            np.concatenate([child_opp, own[passing]]),
+            int(np.sum(stuck & ~passing)))
+
+
+# Returns the number of leaves `depth` plies below the boards. A pass
+# counts as a ply, and a game that ends sooner counts as one leaf.
+def perft(own, opp, depth):
+    if depth == 0:
+        return len(own)
+    if len(own) > PERFT_BOARDS:
+        return sum(perft(own[i:i + PERFT_BOARDS], opp[i:i + PERFT_BOARDS], depth)
+                   for i in xrange(0, len(own), PERFT_BOARDS))
+    own, opp, finished = expand(own, opp)
+    return finished + perft(own, opp, depth - 1)
+
+
+# Plays n games of random moves in lockstep. Returns (moves, scores):
+# the (n, 60) array of the squares played in each game, padded with -1
+# (passes are left out), and the final disc difference for player 1.
+def random_games(n, rand):
+    own, opp = initial_boards(n)
+    player = np.ones(n, dtype=np.int8)
+    played = np.empty((n, 60), dtype=np.int8)
+    played.fill(-1)
+    count = np.zeros(n, dtype=np.int32)
+    final = np.zeros(n, dtype=np.int32)
+    active = np.arange(n)
+    while len(active):
+        moves = move_masks(own, opp)
+        # Pass where the player has no move but the opponent has.
+        passing = (moves == 0) & (move_masks(opp, own) != 0)
+        own, opp = np.where(passing, opp, own), np.where(passing, own, opp)
+        player = np.where(passing, 3 - player, player)
+        moves = np.where(passing, move_masks(own, opp), moves)
+        # Games where neither player can move are over.
+        over = moves == 0
+        if over.any():
+            done = active[over]
+            p1 = np.where(player[over] == 1, own[over], opp[over])
+            p2 = np.where(player[over] == 1, opp[over], own[over])
+            final[done] = final_scores(p1, p2)
+            keep = ~over
+            own, opp, player, moves, active = own[keep], opp[keep], player[keep], moves[keep], active[keep]
+            if not len(active):
+                break
+        sq = random_moves(moves, rand)
+        played[active, count[active]] = sq
+        count[active] += 1
+        own, opp = play(own, opp, sq)
+        player = 3 - player
+    return played, final
+
+
+# Returns the final disc differences for the players owning `own`, like
+# bitboard.final_score.
+def final_scores(own, opp):
+    mine, theirs = popcounts(own), popcounts(opp)
+    return np.where(mine > theirs, 64 - 2 * theirs, np.where(mine < theirs, 2 * mine - 64, 0))
+
+
+# The name of every square in record notation, then '' for the -1
+# padding of random_games.
+NAMES = ['%s%d' % (chr(ord('a') + sq % 8), sq // 8 + 1) for sq in xrange(64)] + ['']
+
+
+# Returns the record line of a game, as read by train.py, from a list
+# of squares and the final score.
+def record_line(moves, score):
+    return '%s %d\n' % (''.join([NAMES[sq] for sq in moves]), score)
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == 'perft':
+        own, opp = initial_boards(1)
+        for depth in xrange(1, int(sys.argv[2]) + 1):
+            print depth, perft(own, opp, depth)
+    elif len(sys.argv) > 3 and sys.argv[1] == 'games':
+        n = int(sys.argv[2])
+        rand = np.random.RandomState(int(sys.argv[4]) if len(sys.argv) > 4 else None)
+        f = open(sys.argv[3], 'w')
+        try:
+            for start in xrange(0, n, GAME_BOARDS):
+                played, scores = random_games(min(n - start, GAME_BOARDS), rand)
+                f.writelines(record_line(moves, score) for moves, score in zip(played.tolist(), scores.tolist()))
+        finally:
+            f.close()
+    else:
+        sys.stderr.write('usage: multiboard.py perft DEPTH | games N PATH [SEED]\n')
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
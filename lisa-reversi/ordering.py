@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Move ordering for search.Searcher.
+#
+# Alpha-beta cuts the most when the best move is tried first, so the
+# moves of a node are tried in this order:
+#   1. the best move stored in the transposition table, or at the root
+#      without one, the move the game's principal variation expects,
+#   2. the two killer moves of the ply, which caused a cutoff in a
+#      sibling node,
+#   3. the rest by history score plus the BOARD_2 weight of the square.
+
+# Maximum search ply, passes included.
+MAX_PLY = 128
+
+HASH_RANK = 1 << 30
+KILLER_RANK = 1 << 29
+
+
+class MoveOrderer(object):
+    # `weights` is the static score of each square.
+    def __init__(self, weights):
+        self.weights = weights
+        self.clear()
+
+    def clear(self):
+        self.killers = [[None, None] for ply in xrange(MAX_PLY)]
+        # history[player][sq] grows with depth*depth every time the
+        # move caused a cutoff.
+        self.history = [None, [0] * 64, [0] * 64]
+        # Shallow search score of each root move, or None.
+        self.root = None
+        # Move tried first at the root if the table has none, or None.
+        self.root_move = None
+
+    # Sorts `moves` of `player` at `ply` in place, best first.
+    def order(self, moves, player, ply, hash_move=None):
+        if ply == 0 and hash_move is None:
+            hash_move = self.root_move
+        if ply == 0 and self.root is not None:
+            root = self.root
+            moves.sort(key=lambda sq: HASH_RANK if sq == hash_move else root[sq], reverse=True)
+            return moves
+        killers = self.killers[ply]
+        history = self.history[player]
+        weights = self.weights
+
+        def rank(sq):
+            if sq == hash_move:
+                return HASH_RANK
+            if sq == killers[0]:
+                return KILLER_RANK
+            if sq == killers[1]:
+                return KILLER_RANK - 1
+            return history[sq] + weights[sq]
+        moves.sort(key=rank, reverse=True)
+        return moves
+
+    # Records that `move` of `player` caused a beta cutoff.
+    def cutoff(self, move, player, ply, depth):
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        self.history[player][move] += depth * depth
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Root-split parallel search over a process pool.
+#
+# Each iteration of the iterative deepening searches the first root
+# move in this process to get an alpha bound, then hands the other root
+# moves to the pool. Workers read the best score found so far from a
+# shared value when they start a move, and raise it when they beat it,
+# so later moves are searched with a narrower window.
+#
+# Positions are sent as (p1, p2, next) integers, and every worker keeps
+# its own Searcher, and so its transposition table, between requests.
+#
+# With few root moves, as is common near the end of the game, there is
+# little to split. deepen_shared instead runs the whole iterative
+# deepening in every process at staggered depths over one transposition
+# table in shared memory (lazy SMP): the helpers fill the table with
+# results the main search then finds, and the main search's result is
+# returned.
+
+import ctypes
+import multiprocessing
+import threading
+import time
+
+import bitboard
+import search
+from bitboard import squares
+from search import INFINITY, Timeout
+from transposition import SharedTranspositionTable, slot_count
+
+# Entries of the table shared by deepen_shared.
+SHARED_ENTRIES = 1 << 18
+
+# The pool and the shared alpha, created by get_pool. There is one
+# alpha for all requests, so _lock lets only one deepen use the pool at
+# a time.
+_pool = None
+_alpha = None
+_lock = threading.Lock()
+
+# The pool and the main process's Searcher, created by get_shared_pool.
+# They are shared by all requests, so _shared_lock lets only one
+# deepen_shared use them at a time.
+_shared_pool = None
+_shared_searcher = None
+_shared_lock = threading.Lock()
+
+# Set in each worker process by _init_worker and _init_shared_worker.
+_shared_alpha = None
+_searcher = None
+
+
+def _init_worker(alpha, evaluator):
+    global _shared_alpha, _searcher
+    _shared_alpha = alpha
+    _searcher = search.Searcher(evaluator=evaluator)
+
+
+# Runs in a worker. Returns (move, score, alpha) with the alpha the move
+# was searched with, or (move, None, alpha) if the deadline passed
+# first.
+def _search_move(task):
+    p1, p2, next, move, depth, final, count_discs, deadline = task
+    pos = _searcher.attach(bitboard.Position(p1, p2, next))
+    alpha = _shared_alpha.value
+    _searcher.deadline = deadline
+    try:
+        point = _searcher.search_move(pos, move, depth, alpha, INFINITY, final, count_discs)
+    except Timeout:
+        return move, None, alpha
+    finally:
+        _searcher.deadline = float('inf')
+    with _shared_alpha.get_lock():
+        if point > _shared_alpha.value:
+            _shared_alpha.value = point
+    return move, point, alpha
+
+
+# Returns the pool of `processes` workers searching with `evaluator`,
+# creating it on first use. The pool lives as long as this process, so
+# it is shared by all requests.
+def get_pool(processes, evaluator=None):
+    global _pool, _alpha
+    if _pool is None:
+        _alpha = multiprocessing.Value('l', -INFINITY)
+        _pool = multiprocessing.Pool(processes, _init_worker, (_alpha, evaluator))
+    return _pool
+
+
+# Like Searcher.deepen but splits the root moves of every iteration
+# over a pool of `processes` workers. `searcher` searches the first
+# move of each iteration.
+def deepen(searcher, processes, pos, deadline, max_depth, final=False, count_discs=False):
+    with _lock:
+        return _deepen(searcher, processes, pos, deadline, max_depth, final, count_discs)
+
+
+def _deepen(searcher, processes, pos, deadline, max_depth, final, count_discs):
+    pool = get_pool(processes, searcher.evaluator)
+    p1, p2, next = pos.discs[1], pos.discs[2], pos.next
+    pos = searcher.attach(pos)
+    moves = squares(pos.moves())
+    result = None
+    for depth in xrange(1, max_depth + 1):
+        first = moves[0]
+        if result is not None:
+            searcher.deadline = deadline
+        try:
+            alpha = searcher.search_move(pos.copy(), first, depth, final=final, count_discs=count_discs)
+        except Timeout:
+            break
+        finally:
+            searcher.deadline = float('inf')
+        scores = {first: alpha}
+        # The moves whose score is exact, not an upper bound.
+        exact = [first]
+        _alpha.value = alpha
+        tasks = [(p1, p2, next, move, depth, final, count_discs, deadline) for move in moves[1:]]
+        finished = True
+        for move, point, searched_alpha in pool.imap_unordered(_search_move, tasks):
+            if point is None:
+                finished = False
+            else:
+                scores[move] = point
+                if point > searched_alpha:
+                    exact.append(move)
+        # The first iteration has no earlier result to fall back to.
+        if not finished and result is not None:
+            break
+        # A score at or below the alpha its move was searched with is
+        # only an upper bound, and may equal the best score while the
+        # move is much worse, so the best is picked from exact scores.
+        best = max(exact, key=scores.get)
+        result = scores[best], best, depth
+        # The next iteration starts with the best move and then tries
+        # the others from best to worst score.
+        moves.sort(key=lambda move: scores.get(move, -INFINITY), reverse=True)
+        if time.time() > deadline:
+            break
+    return result
+
+
+def _init_shared_worker(words, evaluator):
+    global _searcher
+    _searcher = search.Searcher(SharedTranspositionTable(words), evaluator)
+
+
+# Runs in a worker: a whole iterative deepening starting at `start`.
+# Unlike a search of its own, its first iteration is not needed for a
+# result, so it stops at the deadline too.
+def _deepen_shared(task):
+    p1, p2, next, start, deadline, max_depth, final, count_discs = task
+    pos = bitboard.Position(p1, p2, next)
+    return _searcher.deepen(pos, deadline, max_depth, final, count_discs, start=start, bounded=True)
+
+
+# Returns the pool of `processes` helpers and the Searcher of this
+# process, which share one transposition table and search with
+# `evaluator`. Both are created on first use and shared by all
+# requests.
+def get_shared_pool(processes, evaluator=None):
+    global _shared_pool, _shared_searcher
+    if _shared_pool is None:
+        words = multiprocessing.RawArray(ctypes.c_uint64, 4 * slot_count(SHARED_ENTRIES))
+        _shared_searcher = search.Searcher(SharedTranspositionTable(words), evaluator)
+        _shared_pool = multiprocessing.Pool(processes, _init_shared_worker, (words, evaluator))
+    return _shared_pool, _shared_searcher
+
+
+# Like Searcher.deepen but with `processes` helpers deepening the same
+# position over a shared transposition table. Half of the helpers start
+# one ply deeper than the others, so that they are not all working on
+# the same iteration. Returns the result of this process's search.
+def deepen_shared(processes, pos, deadline, max_depth, final=False, count_discs=False, evaluator=None):
+    with _shared_lock:
+        pool, searcher = get_shared_pool(processes, evaluator)
+        helpers = []
+        for i in xrange(processes):
+            task = (pos.discs[1], pos.discs[2], pos.next, 2 + i % 2, deadline, max_depth, final, count_discs)
+            helpers.append(pool.apply_async(_deepen_shared, (task,)))
+        result = searcher.deepen(pos, deadline, max_depth, final, count_discs)
+        # The helpers stop at the same deadline; waiting for them keeps
+        # the next search from queueing behind them.
+        for helper in helpers:
+            helper.wait()
+        return result
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Pattern evaluation.
+#
+# A pattern is a set of squares, such as an edge or a corner region,
+# and each of its symmetric images on the board is an instance. The
+# squares of an instance read as a base 3 number (0 empty, 1 player 1,
+# 2 player 2, the first square lowest) give its code, and every
+# pattern has a table of weights indexed by code. A position scores
+# the sum of the weights of all its instances, for player 1.
+#
+# The tables of all patterns are stored one after the other in one
+# flat array, so an instance is tracked as its offset plus its code:
+# an index into the flat array. PatternIndices keeps these up to date
+# as bitboard.Position plays and takes back moves.
+#
+# Weights file format: the 4 byte magic "PWT1", then the flat array as
+# little endian int16.
+#
+# To write weights that reproduce the BOARD_2 square weights, the
+# starting point for training:
+#   python patterns.py patterns.weights
+
+import sys
+
+import numpy as np
+
+import multiboard
+from bitboard import popcount
+
+MAGIC = 'PWT1'
+WEIGHT_TYPE = np.dtype('<i2')
+
+
+# Returns the distinct images of a list of (x, y) squares under the 8
+# symmetries of the board, as lists of bitboard squares.
+def instances(shape):
+    seen = set()
+    result = []
+    for t in xrange(8):
+        image = []
+        for x, y in shape:
+            if t & 1:
+                x = 7 - x
+            if t & 2:
+                y = 7 - y
+            if t & 4:
+                x, y = y, x
+            image.append(y * 8 + x)
+        if frozenset(image) not in seen:
+            seen.add(frozenset(image))
+            result.append(image)
+    return result
+
+# (name, squares) of every pattern.
+PATTERNS = [
+    ('line2', [(x, 1) for x in xrange(8)]),
+    ('line3', [(x, 2) for x in xrange(8)]),
+    ('line4', [(x, 3) for x in xrange(8)]),
+    ('diag8', [(i, i) for i in xrange(8)]),
+    ('diag7', [(i, i + 1) for i in xrange(7)]),
+    ('diag6', [(i, i + 2) for i in xrange(6)]),
+    ('diag5', [(i, i + 3) for i in xrange(5)]),
+    ('diag4', [(i, i + 4) for i in xrange(4)]),
+    ('edge2x', [(x, 0) for x in xrange(8)] + [(1, 1), (6, 1)]),
+    ('corner3x3', [(x, y) for y in xrange(3) for x in xrange(3)]),
+    ('corner2x5', [(x, y) for y in xrange(2) for x in xrange(5)]),
+]
+
+
+# Returns (offsets, size): where the table of each pattern starts in
+# the flat array, and the length of the array.
+def table_offsets():
+    offsets = []
+    size = 0
+    for name, shape in PATTERNS:
+        offsets.append(size)
+        size += 3 ** len(shape)
+    return offsets, size
+
+OFFSETS, SIZE = table_offsets()
+
+# (pattern, squares) of every instance.
+INSTANCES = [(p, image) for p, (name, shape) in enumerate(PATTERNS) for image in instances(shape)]
+
+
+# Returns UPDATES[sq]: the (instance, 3 ** position of sq in it) of the
+# instances holding sq.
+def square_updates():
+    updates = [[] for sq in xrange(64)]
+    for i, (p, image) in enumerate(INSTANCES):
+        for k, sq in enumerate(image):
+            updates[sq].append((i, 3 ** k))
+    return updates
+
+UPDATES = square_updates()
+
+
+# Returns the flat array indexes of the instances of a position.
+def pattern_indexes(p1, p2):
+    indexes = []
+    for p, image in INSTANCES:
+        code = 0
+        for sq in reversed(image):
+            code = code * 3 + (1 if p1 >> sq & 1 else 2 if p2 >> sq & 1 else 0)
+        indexes.append(OFFSETS[p] + code)
+    return indexes
+
+
+# Like pattern_indexes for N positions at once, given as uint64 arrays
+# of bitboards: returns their (N, 46) int32 indexes.
+def pattern_index_array(p1, p2):
+    state = multiboard.square_bits(p1).astype(np.int32) + 2 * multiboard.square_bits(p2)
+    indexes = np.empty((len(p1), len(INSTANCES)), dtype=np.int32)
+    for i, (p, image) in enumerate(INSTANCES):
+        indexes[:, i] = OFFSETS[p] + np.dot(state[:, image], 3 ** np.arange(len(image)))
+    return indexes
+
+
+# The flat array indexes of a position's instances, kept up to date by
+# bitboard.Position.make_move and unmake_move.
+class PatternIndices(object):
+    __slots__ = ('indexes',)
+
+    def __init__(self, indexes):
+        self.indexes = indexes
+
+    def copy(self):
+        return PatternIndices(self.indexes[:])
+
+    # Updates the indexes for `player` playing `sq` and flipping the
+    # pieces in `flips`, or with `sign` -1 takes that back.
+    def play(self, player, sq, flips, sign=1):
+        indexes = self.indexes
+        for i, power in UPDATES[sq]:
+            indexes[i] += sign * player * power
+        # A flip turns a 2 into a 1 for player 1 and the other way
+        # round for player 2.
+        delta = sign * (2 * player - 3)
+        while flips:
+            low = flips & -flips
+            for i, power in UPDATES[low.bit_length() - 1]:
+                indexes[i] += delta * power
+            flips ^= low
+
+
+class PatternEvaluator(object):
+    # `weights` is the flat array of every pattern's table.
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=WEIGHT_TYPE)
+        if len(weights) != SIZE:
+            raise ValueError('%d pattern weights, expected %d' % (len(weights), SIZE))
+        self.weights = weights
+        # Lists index faster than arrays one element at a time.
+        self.table = weights.tolist()
+
+    @classmethod
+    def load(cls, path):
+        f = open(path, 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a pattern weights file' % path)
+        return cls(np.frombuffer(data[len(MAGIC):], dtype=WEIGHT_TYPE))
+
+    # Starts keeping the pattern indexes of pos as it is played.
+    def attach(self, pos):
+        pos.patterns = PatternIndices(pattern_indexes(pos.discs[1], pos.discs[2]))
+
+    # Returns the pattern score plus mobility of the player to move,
+    # like evaluate.calculate_point.
+    def calculate_point(self, pos, moves):
+        if pos.patterns is not None:
+            indexes = pos.patterns.indexes
+        else:
+            indexes = pattern_indexes(pos.discs[1], pos.discs[2])
+        point = sum(map(self.table.__getitem__, indexes))
+        if pos.next == 2:
+            point = -point
+        return point + popcount(moves)
+
+
+# Writes the flat array of weights to a weights file.
+def write_weights(path, weights):
+    f = open(path, 'wb')
+    try:
+        f.write(MAGIC)
+        f.write(np.asarray(np.round(weights), dtype=WEIGHT_TYPE).tostring())
+    finally:
+        f.close()
+
+
+# Returns the flat array of weights whose pattern score is exactly the
+# score of the 8x8 `board` of integer square weights. Every square's
+# weight goes to the first pattern with only one instance holding the
+# square; there is one for every square. The instances of a pattern
+# share a table, so `board` must be symmetric.
+def board_weights(board):
+    weights = np.zeros(SIZE)
+    board = np.asarray(board).flatten()
+    owner = []
+    for sq in xrange(64):
+        holding = [INSTANCES[i][0] for i, power in UPDATES[sq]]
+        owner.append(min(p for p in holding if holding.count(p) == 1))
+    for p, image in dict(reversed(INSTANCES)).iteritems():
+        n = len(image)
+        codes = np.arange(3 ** n)
+        table = np.zeros(3 ** n)
+        for k, sq in enumerate(image):
+            if owner[sq] == p:
+                state = codes // 3 ** k % 3
+                table += np.where(state == 1, board[sq], np.where(state == 2, -board[sq], 0))
+        weights[OFFSETS[p]:OFFSETS[p] + 3 ** n] = table
+    return weights
+
+
+if __name__ == '__main__':
+    import evaluate
+    write_weights(sys.argv[1], board_weights(evaluate.BOARD_2))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Pondering: searching on the opponent's time.
+#
+# After a move is sent, a background thread searches the position
+# after every reply of the opponent, the likeliest replies first, with
+# iterative deepening. It searches with the Searcher of the game's
+# session, so the results fill the table the game's next request
+# searches with, and are kept by position too: the next request either
+# finds its position already searched (a ponder hit) or starts with a
+# warm table.
+
+import threading
+import time
+
+from bitboard import squares
+from search import Timeout
+
+
+# Ponders one game at a time, the one of the latest request.
+class Ponderer(object):
+    def __init__(self):
+        # The searcher of the game being pondered, or None.
+        self.searcher = None
+        # Held by the request that stopped the pondering.
+        self.lock = threading.Lock()
+        self.thread = None
+        # (p1, p2, next) -> (move, score, depth) of every pondered
+        # position.
+        self.results = {}
+
+    # Stops the pondering for a request. Returns False if another request
+    # already did; that request holds the ponderer until release.
+    def acquire(self):
+        if not self.lock.acquire(False):
+            return False
+        if self.thread is not None:
+            if self.thread.is_alive():
+                # Makes the search raise Timeout at its next check.
+                self.searcher.deadline = 0
+            self.thread.join()
+            self.thread = None
+            # The thread may have reset the deadline before the one
+            # above was set.
+            self.searcher.deadline = float('inf')
+            self.searcher = None
+        return True
+
+    # Ponders the replies to pos, the position after our move, with
+    # `searcher` for `budget` seconds, and lets the next request stop
+    # it. Nothing is pondered if pos is None.
+    def release(self, pos, budget, searcher):
+        self.results = {}
+        replies = squares(pos.moves()) if pos is not None else []
+        if replies:
+            self.searcher = searcher
+            # Set here rather than in the thread, so that acquire can
+            # never be overridden by a thread that has not started yet.
+            self.searcher.deadline = time.time() + budget
+            self.thread = threading.Thread(target=self.ponder, args=(pos, replies))
+            self.thread.daemon = True
+            self.thread.start()
+        self.lock.release()
+
+    # Returns (move, score, depth) pondered for pos, or None.
+    def lookup(self, pos):
+        return self.results.get((pos.discs[1], pos.discs[2], pos.next))
+
+    def ponder(self, pos, replies):
+        searcher = self.searcher
+        pos = searcher.attach(pos)
+        try:
+            # The opponent's likeliest replies are the ones a shallow
+            # search of ours likes best for them.
+            replies.sort(key=lambda move: searcher.search_move(pos.copy(), move, 2), reverse=True)
+            positions = [searcher.attach(pos.play(move)) for move in replies]
+            positions = [child for child in positions if child.moves()]
+            for depth in xrange(1, 61):
+                for child in positions:
+                    point, move = searcher.choose(child.copy(), depth)
+                    self.results[(child.discs[1], child.discs[2], child.next)] = (move, point, depth)
+        except Timeout:
+            pass
+        finally:
+            searcher.deadline = float('inf')
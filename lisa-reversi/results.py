@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Cache of searched moves across requests.
+#
+# Positions are keyed like the opening book, by the (own, opp)
+# bitboards of the player to move normalised over the 8 symmetries, so
+# a rotated or reflected position is a hit too. Each entry records the
+# move, its score, the depth searched and whether the score is exact,
+# so the caller can tell whether it is as good as the search it would
+# run now.
+#
+# Entries are kept in an in-process LRU and, optionally, in a file that
+# survives restarts. The file is a memory-mapped hash table: the 8 byte
+# header "RCH2" plus the number of slots (uint32), then fixed size
+# slots of three little endian uint64 words, own xor data, opp xor data
+# and data, the entry as packed by transposition.pack, all 0 for an
+# empty slot. Like transposition.SharedTranspositionTable, a slot torn
+# by two processes writing it at once no longer matches its key and is
+# just a miss.
+
+import collections
+import os
+import struct
+import threading
+
+try:
+    import mmap
+except ImportError:
+    mmap = None
+
+from bitboard import popcount, squares
+from book import UNTRANSFORM, canonical, transform
+from transposition import pack, unpack, zobrist_pair
+
+MAGIC = 'RCH2'
+HEADER = struct.Struct('<4sI')
+SLOT = struct.Struct('<QQQ')
+# Slots looked at from the one a key hashes to.
+PROBES = 4
+
+# Entries are packed with transposition.pack, whose bound field holds
+# whether the score is exact.
+SEARCHED = 0
+SOLVED = 1
+
+
+# Returns how much packed data is worth keeping: its depth, exact
+# entries above any depth.
+def worth(data):
+    _, depth, _, bound, _ = unpack(None, data)
+    return depth + (256 if bound == SOLVED else 0)
+
+
+# The file tier: a hash table of `slots` slots in a memory-mapped file,
+# created if it does not exist.
+class ResultFile(object):
+    def __init__(self, path, slots=1 << 20):
+        if not os.path.exists(path):
+            f = open(path, 'wb')
+            try:
+                f.write(HEADER.pack(MAGIC, slots))
+                f.truncate(HEADER.size + slots * SLOT.size)
+            finally:
+                f.close()
+        f = open(path, 'r+b')
+        try:
+            self.data = mmap.mmap(f.fileno(), 0)
+        finally:
+            f.close()
+        magic, slots = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or len(self.data) != HEADER.size + slots * SLOT.size:
+            raise ValueError('%s is not a result cache' % path)
+        self.slots = slots
+
+    # Returns the offsets of the slots a key may be in.
+    def offsets(self, own, opp):
+        i = zobrist_pair(own, opp)
+        return [HEADER.size + (i + k) % self.slots * SLOT.size for k in xrange(PROBES)]
+
+    # Returns the packed data stored for (own, opp), or 0.
+    def get(self, own, opp):
+        for offset in self.offsets(own, opp):
+            w0, w1, data = SLOT.unpack_from(self.data, offset)
+            if data and w0 ^ data == own and w1 ^ data == opp:
+                return data
+        return 0
+
+    # Stores packed data for (own, opp) in its own slot if it has one,
+    # unless that holds an entry of more worth, otherwise in an empty
+    # slot or over the one of least worth.
+    def put(self, own, opp, data):
+        target = None
+        for offset in self.offsets(own, opp):
+            w0, w1, old = SLOT.unpack_from(self.data, offset)
+            if old and w0 ^ old == own and w1 ^ old == opp:
+                if worth(old) > worth(data):
+                    return
+                target = offset
+                break
+            value = worth(old) if old else -1
+            if target is None or value < lowest:
+                target, lowest = offset, value
+        SLOT.pack_into(self.data, target, own ^ data, opp ^ data, data)
+
+    def flush(self):
+        self.data.flush()
+
+
+# Searched moves by canonical position: up to `entries` in memory, least
+# recently used first, and all of them in the file at `path` if given.
+class ResultCache(object):
+    def __init__(self, entries=1 << 16, path=None, slots=1 << 20):
+        self.entries = entries
+        self.lock = threading.Lock()
+        self.memory = collections.OrderedDict()
+        self.file = ResultFile(path, slots) if path is not None and mmap is not None else None
+        # (empty squares, budget) -> depth the latest search reached,
+        # what a search in that much time is expected to reach now.
+        self.depths = {}
+
+    # Returns the depth the latest search of a position with `empty`
+    # empty squares reached in `budget` seconds, or None.
+    def expected_depth(self, empty, budget):
+        return self.depths.get((empty, budget))
+
+    # Returns (move, score, depth, exact) of pos if an entry is exact or
+    # searched at least `depth` plies; with `exact`, only if it is
+    # exact. The move is a square of pos.
+    def lookup(self, pos, depth=None, exact=False):
+        if depth is None and not exact:
+            return None
+        own, opp, t = canonical(pos.discs[pos.next], pos.discs[3 - pos.next])
+        with self.lock:
+            data = self.memory.pop((own, opp), 0)
+            if not data and self.file is not None:
+                data = self.file.get(own, opp)
+            if not data:
+                return None
+            self.remember(own, opp, data)
+        _, found, score, bound, move = unpack(None, data)
+        is_exact = bound == SOLVED
+        if not is_exact and (exact or found < depth):
+            return None
+        return UNTRANSFORM[t][move], score, found, is_exact
+
+    # Stores the move searched in pos. With a budget, also records the
+    # depth as the one expected of searches in that much time.
+    def store(self, pos, move, score, depth, exact=False, budget=None):
+        own, opp, t = canonical(pos.discs[pos.next], pos.discs[3 - pos.next])
+        data = pack(depth, score, SOLVED if exact else SEARCHED, squares(transform(1 << move, t))[0])
+        with self.lock:
+            if budget is not None:
+                self.depths[(64 - popcount(own | opp), budget)] = depth
+            old = self.memory.pop((own, opp), 0)
+            if old and worth(old) > worth(data):
+                data = old
+            self.remember(own, opp, data)
+            if self.file is not None:
+                self.file.put(own, opp, data)
+
+    # Makes (own, opp) the most recently used entry, evicting the least
+    # recently used one if there are too many.
+    def remember(self, own, opp, data):
+        self.memory[(own, opp)] = data
+        if len(self.memory) > self.entries:
+            self.memory.popitem(last=False)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Sampling profiler with a flame graph report.
+#
+# A background thread looks at the stack of the profiled thread every
+# `interval` seconds and counts each distinct stack. The report is in
+# the collapsed stack format of flamegraph.pl and speedscope: one line
+# per stack, frames from the outermost in, separated by ';', then the
+# number of samples.
+
+import os
+import sys
+import threading
+import time
+
+
+class Sampler(object):
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.counts = {}
+        self.thread = None
+        self.running = False
+
+    # Starts sampling the calling thread.
+    def start(self):
+        self.counts = {}
+        self.running = True
+        target = threading.current_thread().ident
+        self.thread = threading.Thread(target=self.run, args=(target,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.thread = None
+
+    def run(self, target):
+        counts = self.counts
+        while self.running:
+            frame = sys._current_frames().get(target)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s:%s' % (os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                key = ';'.join(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+            time.sleep(self.interval)
+
+    # Returns the collapsed stacks, most sampled first.
+    def collapsed(self):
+        stacks = sorted(self.counts.iteritems(), key=lambda item: item[1], reverse=True)
+        return ''.join('%s %d\n' % (stack, count) for stack, count in stacks)
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Negamax alpha-beta search over bitboard.Position.
+#
+# Every score is from the point of view of the player to move in the
+# position being searched, so a child's score is negated on the way up.
+
+import time
+
+import bitboard
+import evaluate
+from bitboard import final_score, move_mask, popcount, squares
+from evaluate import WEIGHTS_2
+from ordering import MoveOrderer
+from transposition import EXACT, LOWER, UPPER, TranspositionTable, zobrist
+
+# Bigger than any score the evaluation can return.
+INFINITY = 1000000
+
+# A finished game scores its final disc difference times GAME_OVER,
+# so that winning outweighs any evaluation.
+GAME_OVER = 1000
+
+# Weight of the openness term in choose.
+OPENNESS = 3
+
+# Xored into the Zobrist key of choose_final nodes, so that they do
+# not share table entries with choose, which scores leaves differently.
+FINAL_KEY = 0x5BD1E9955BD1E995
+DISCS_KEY = 0x9E3779B97F4A7C15
+
+# The deadline is checked once every CHECK_MASK + 1 nodes.
+CHECK_MASK = 255
+
+
+# Raised from inside the search when the deadline has passed.
+class Timeout(Exception):
+    pass
+
+
+class Searcher(object):
+    # `table` is the TranspositionTable to use; it is kept for the
+    # whole life of the Searcher. `evaluator`, such as a
+    # patterns.PatternEvaluator, replaces the BOARD_2 evaluation.
+    def __init__(self, table=None, evaluator=None):
+        if table is None:
+            table = TranspositionTable()
+        self.table = table
+        self.evaluator = evaluator
+        self.evaluate = evaluate.calculate_point if evaluator is None else evaluator.calculate_point
+        self.orderer = MoveOrderer(WEIGHTS_2)
+        # Number of nodes visited, leaves included.
+        self.nodes = 0
+        # time.time() after which the search raises Timeout.
+        self.deadline = float('inf')
+
+    # Iterative deepening: searches 1, 2, ... max_depth plies until
+    # `deadline` passes, and returns (score, move, depth) of the deepest
+    # iteration that finished. The first iteration always finishes,
+    # unless `bounded`, when it may return None.
+    # With `final` the iterations run choose_final instead of choose.
+    # With `shallow` the root moves are first ordered by a search of
+    # that depth. The iterations start at depth `start`.
+    def deepen(self, pos, deadline, max_depth, final=False, count_discs=False, shallow=0, start=1,
+               bounded=False):
+        # Set here, whatever deadline the searcher was left with.
+        self.deadline = deadline if bounded else float('inf')
+        pos = self.attach(pos)
+        if shallow:
+            self.order_root(pos, shallow, final, count_discs)
+        result = None
+        for depth in xrange(start, max_depth + 1):
+            # An aborted iteration leaves its position half played.
+            root = pos.copy()
+            try:
+                if final:
+                    point, move = self.choose_final(root, depth, count_discs=count_discs)
+                else:
+                    point, move = self.choose(root, depth)
+            except Timeout:
+                break
+            result = point, move, depth
+            # Only the first iteration may run without a deadline.
+            self.deadline = deadline
+            if time.time() > deadline:
+                break
+        self.deadline = float('inf')
+        self.orderer.root = None
+        self.orderer.root_move = None
+        return result
+
+    # Returns pos, or with an evaluator a copy of it that keeps the
+    # evaluator's incremental state as it is played. Positions must go
+    # through this before search_move or choose, or the evaluator
+    # recomputes that state at every leaf.
+    def attach(self, pos):
+        if self.evaluator is not None:
+            pos = pos.copy()
+            self.evaluator.attach(pos)
+        return pos
+
+    # Scores every root move with a full window search of `depth`
+    # plies, for MoveOrderer to try the root moves in that order.
+    def order_root(self, pos, depth, final=False, count_discs=False):
+        root = {}
+        for move in squares(pos.moves()):
+            root[move] = self.search_move(pos, move, depth, final=final, count_discs=count_discs)
+        self.orderer.root = root
+
+    # Returns the score of `move` in pos within (alpha, beta), the way
+    # the root of a `depth` ply choose (or choose_final with `final`)
+    # scores it.
+    def search_move(self, pos, move, depth, alpha=-INFINITY, beta=INFINITY, final=False, count_discs=False):
+        undo = pos.make_move(move)
+        if final:
+            point, _ = self.choose_final(pos, depth - 1, -beta, -alpha, count_discs, 1)
+            point = -point
+        else:
+            bonus = OPENNESS * self.calculateOpenness(pos, undo)
+            point, _ = self.choose(pos, depth - 1, bonus - beta, bonus - alpha, 1)
+            point = bonus - point
+        pos.unmake_move(undo)
+        return point
+
+    # Returns the moves of the principal variation from pos as stored in
+    # the table by choose, at most `limit` of them. Passes are None.
+    def principal_variation(self, pos, limit=8):
+        pos = pos.copy()
+        pv = []
+        seen = set()
+        while len(pv) < limit:
+            key = zobrist(pos)
+            entry = self.table.probe(key)
+            if key in seen or entry is None or entry[4] is None or not pos.moves() >> entry[4] & 1:
+                if pos.moves() or not move_mask(pos.discs[3 - pos.next], pos.discs[pos.next]):
+                    break
+                pv.append(None)
+                pos.pass_turn()
+                continue
+            seen.add(key)
+            pv.append(entry[4])
+            pos.make_move(entry[4])
+        return pv
+
+    # Returns (hit, hash move) for `key`. hit is the stored (score,
+    # move) if it decides this node's score for the (alpha, beta)
+    # window, None otherwise.
+    def lookup(self, key, depth, alpha, beta):
+        entry = self.table.probe(key)
+        if entry is None:
+            return None, None
+        _, stored_depth, point, bound, move = entry
+        if stored_depth >= depth and (bound == EXACT or (bound == LOWER and point >= beta)
+                                      or (bound == UPPER and point <= alpha)):
+            return (point, move), move
+        return None, move
+
+    def save(self, key, depth, alpha, beta, point, move):
+        if point <= alpha:
+            bound = UPPER
+        elif point >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.table.store(key, depth, point, bound, move)
+
+    # Searches `depth` plies and returns (score, best move). Each move
+    # also scores OPENNESS times its openness, and leaves add the
+    # openness of the opponent's best reply.
+    def choose(self, pos, depth, alpha=-INFINITY, beta=INFINITY, ply=0):
+        self.nodes += 1
+        if not self.nodes & CHECK_MASK and time.time() > self.deadline:
+            raise Timeout()
+        if depth == 0:
+            return self.leaf_point(pos, alpha), None
+
+        validmove = squares(pos.moves())
+        if not validmove:
+            own, opp = pos.discs[pos.next], pos.discs[3 - pos.next]
+            if not move_mask(opp, own):
+                return GAME_OVER * final_score(own, opp), None
+            pos.pass_turn()
+            point, _ = self.choose(pos, depth, -beta, -alpha, ply + 1)
+            pos.pass_turn()
+            return -point, None
+
+        key = zobrist(pos)
+        hit, hash_move = self.lookup(key, depth, alpha, beta)
+        if hit is not None:
+            return hit
+        self.orderer.order(validmove, pos.next, ply, hash_move)
+
+        best_point = -INFINITY
+        best_move = None
+        for move in validmove:
+            undo = pos.make_move(move)
+            bonus = OPENNESS * self.calculateOpenness(pos, undo)
+            if depth == 1:
+                # The children are leaves: scored here rather than by a
+                # call to choose each, the bulk of all nodes.
+                self.nodes += 1
+                if not self.nodes & CHECK_MASK and time.time() > self.deadline:
+                    raise Timeout()
+                point = self.leaf_point(pos, bonus - beta)
+            else:
+                point, _ = self.choose(pos, depth - 1, bonus - beta, bonus - max(alpha, best_point), ply + 1)
+            pos.unmake_move(undo)
+            point = bonus - point
+            if point > best_point:
+                best_point = point
+                best_move = move
+                if point >= beta:
+                    self.orderer.cutoff(move, pos.next, ply, depth)
+                    break
+        self.save(key, depth, alpha, beta, best_point, best_move)
+        return best_point, best_move
+
+    # Like choose but without the openness terms. With count_discs the
+    # leaves are scored by disc difference instead of calculatePoint.
+    def choose_final(self, pos, depth, alpha=-INFINITY, beta=INFINITY, count_discs=False, ply=0):
+        self.nodes += 1
+        if not self.nodes & CHECK_MASK and time.time() > self.deadline:
+            raise Timeout()
+        if depth == 0:
+            return self.final_leaf_point(pos, count_discs), None
+
+        validmove = squares(pos.moves())
+        if not validmove:
+            own, opp = pos.discs[pos.next], pos.discs[3 - pos.next]
+            if not move_mask(opp, own):
+                return (1 if count_discs else GAME_OVER) * final_score(own, opp), None
+            pos.pass_turn()
+            point, _ = self.choose_final(pos, depth, -beta, -alpha, count_discs, ply + 1)
+            pos.pass_turn()
+            return -point, None
+
+        key = zobrist(pos) ^ (DISCS_KEY if count_discs else FINAL_KEY)
+        hit, hash_move = self.lookup(key, depth, alpha, beta)
+        if hit is not None:
+            return hit
+        self.orderer.order(validmove, pos.next, ply, hash_move)
+
+        best_point = -INFINITY
+        best_move = None
+        for move in validmove:
+            undo = pos.make_move(move)
+            if depth == 1:
+                # As in choose.
+                self.nodes += 1
+                if not self.nodes & CHECK_MASK and time.time() > self.deadline:
+                    raise Timeout()
+                point = self.final_leaf_point(pos, count_discs)
+            else:
+                point, _ = self.choose_final(pos, depth - 1, -beta, -max(alpha, best_point), count_discs, ply + 1)
+            pos.unmake_move(undo)
+            point = -point
+            if point > best_point:
+                best_point = point
+                best_move = move
+                if point >= beta:
+                    self.orderer.cutoff(move, pos.next, ply, depth)
+                    break
+        self.save(key, depth, alpha, beta, best_point, best_move)
+        return best_point, best_move
+
+    # Score of a leaf of choose: calculatePoint plus the openness of the
+    # most open move the player to move has. Openness only lowers the
+    # score, so once it is at most `alpha` the remaining moves are
+    # skipped and the score is only an upper bound, like the score of a
+    # search that fails low.
+    def leaf_point(self, pos, alpha=-INFINITY):
+        moves = pos.moves()
+        point = self.calculatePoint(pos, moves)
+        final_open = 0
+        for move in squares(moves):
+            if point + OPENNESS * final_open <= alpha:
+                break
+            open = -pos.openness(pos.flips(move))
+            if open < final_open:
+                final_open = open
+        return point + OPENNESS * final_open
+
+    # Score of a leaf of choose_final.
+    def final_leaf_point(self, pos, count_discs):
+        if count_discs:
+            return popcount(pos.discs[pos.next]) - popcount(pos.discs[3 - pos.next])
+        return self.calculatePoint(pos, pos.moves())
+
+    # Positional score plus mobility for the player to move. `moves`
+    # is the legal move mask of h.
+    def calculatePoint(self, h, moves):
+        # more is better
+        return self.evaluate(h, moves)
+
+    # Minus the number of empty squares next to the flipped pieces
+    # before the move. h is the position right after the move recorded
+    # in undo, where `move` no longer counts as empty.
+    def calculateOpenness(self, h, undo):
+        move, flipped = undo
+        openness = h.openness(flipped) + popcount(flipped & bitboard.ADJACENT[move])
+        return openness * (-1)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Per-game sessions, so that successive requests of a game reuse the
+# search of the previous move.
+#
+# Requests carry only the board, so a game is recognised by lineage:
+# after we answer, the session is filed under every position the
+# opponent can reach from ours in one move (or a pass), and the next
+# request of the game finds it by its position.
+
+import collections
+import threading
+
+from bitboard import Position, squares
+from endgame import Solver
+from search import Searcher
+
+# Rough bytes per transposition table entry, the entry tuple included.
+ENTRY_BYTES = 160
+
+
+# Returns the key sessions are filed under for a position.
+def position_key(pos):
+    return pos.discs[1], pos.discs[2], pos.next
+
+
+class Session(object):
+    def __init__(self, searcher_class=Searcher):
+        # Keep the transposition tables and the history and killer
+        # tables of the game.
+        self.searcher = searcher_class()
+        self.solver = Solver()
+        # Principal variation after our last move, starting with the
+        # opponent's expected reply, and the key of that position.
+        self.pv = []
+        self.pv_start = None
+        # Keys the session is filed under.
+        self.keys = []
+
+    # Returns the move the principal variation expects in pos, or None
+    # if the opponent did not play the reply it expected.
+    def expected_move(self, pos):
+        if len(self.pv) < 2 or self.pv_start is None:
+            return None
+        start = Position(*self.pv_start)
+        if self.pv[0] is None:
+            start.pass_turn()
+        else:
+            start.make_move(self.pv[0])
+        if position_key(start) != position_key(pos):
+            return None
+        return self.pv[1]
+
+    # Returns the approximate memory used by the session in bytes.
+    def memory(self):
+        slots = self.searcher.table.mask + 1 + self.solver.table.mask + 1
+        return 2 * slots * ENTRY_BYTES
+
+
+# Sessions by lineage, least recently used first, evicted when their
+# total memory is over `memory` bytes. New sessions search with a
+# Searcher made by `searcher_class`.
+class SessionCache(object):
+    def __init__(self, memory, searcher_class=Searcher):
+        self.memory = memory
+        self.searcher_class = searcher_class
+        self.lock = threading.Lock()
+        self.sessions = collections.OrderedDict()
+        self.index = {}
+
+    # Returns the session of the game pos is in, or a new one. The
+    # session leaves the cache until put back, so two requests never
+    # share it.
+    def take(self, pos):
+        with self.lock:
+            session = self.index.get(position_key(pos))
+            if session is None:
+                return Session(self.searcher_class)
+            self.forget(session)
+        return session
+
+    # Puts session back after we moved to pos.
+    def put(self, session, pos):
+        keys = [position_key(pos.play(move)) for move in squares(pos.moves())]
+        keys.append((pos.discs[1], pos.discs[2], 3 - pos.next))
+        with self.lock:
+            session.pv_start = position_key(pos)
+            session.keys = keys
+            for key in keys:
+                self.index[key] = session
+            self.sessions[session] = True
+            total = sum(s.memory() for s in self.sessions)
+            while total > self.memory and len(self.sessions) > 1:
+                oldest = next(iter(self.sessions))
+                total -= oldest.memory()
+                self.forget(oldest)
+
+    def forget(self, session):
+        del self.sessions[session]
+        for key in session.keys:
+            if self.index.get(key) is session:
+                del self.index[key]
+        session.keys = []
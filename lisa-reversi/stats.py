@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Search instrumentation.
+#
+# InstrumentedSearcher is a search.Searcher that counts what the search
+# does in a Stats. The counting lives only in the subclasses here, so a
+# plain Searcher pays nothing for it.
+
+import time
+
+from evaluate import WEIGHTS_2
+from ordering import MAX_PLY, MoveOrderer
+from search import INFINITY, Searcher
+from transposition import TranspositionTable
+
+
+class Stats(object):
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.nodes = 0
+        self.leaves = 0
+        self.evaluations = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        # cutoffs[i] counts beta cutoffs by the i-th move tried.
+        self.cutoffs = []
+        # (depth, seconds, nodes) of every finished root search.
+        self.iterations = []
+
+    # Returns a snapshot of the counts, which later counting leaves
+    # alone.
+    def as_dict(self):
+        return {
+            'nodes': self.nodes,
+            'leaves': self.leaves,
+            'evaluations': self.evaluations,
+            'table': {'probes': self.probes, 'hits': self.hits, 'stores': self.stores},
+            'cutoffs': list(self.cutoffs),
+            'iterations': [{'depth': d, 'seconds': s, 'nodes': n} for d, s, n in self.iterations],
+        }
+
+
+class CountingTable(TranspositionTable):
+    def __init__(self, stats, entries=1 << 16):
+        TranspositionTable.__init__(self, entries)
+        self.stats = stats
+
+    def probe(self, key):
+        entry = TranspositionTable.probe(self, key)
+        self.stats.probes += 1
+        if entry is not None:
+            self.stats.hits += 1
+        return entry
+
+    def store(self, key, depth, score, bound, move):
+        self.stats.stores += 1
+        TranspositionTable.store(self, key, depth, score, bound, move)
+
+
+class CountingOrderer(MoveOrderer):
+    def __init__(self, stats, weights):
+        MoveOrderer.__init__(self, weights)
+        self.stats = stats
+        # The moves last ordered at each ply, to find the index of a
+        # cutoff move.
+        self.ordered = [None] * MAX_PLY
+
+    def order(self, moves, player, ply, hash_move=None):
+        self.ordered[ply] = MoveOrderer.order(self, moves, player, ply, hash_move)
+        return self.ordered[ply]
+
+    def cutoff(self, move, player, ply, depth):
+        MoveOrderer.cutoff(self, move, player, ply, depth)
+        cutoffs = self.stats.cutoffs
+        i = self.ordered[ply].index(move)
+        while len(cutoffs) <= i:
+            cutoffs.append(0)
+        cutoffs[i] += 1
+
+
+class InstrumentedSearcher(Searcher):
+    def __init__(self, stats=None, evaluator=None):
+        if stats is None:
+            stats = Stats()
+        self.stats = stats
+        Searcher.__init__(self, CountingTable(stats), evaluator)
+        self.orderer = CountingOrderer(stats, WEIGHTS_2)
+
+    def choose(self, pos, depth, alpha=-INFINITY, beta=INFINITY, ply=0):
+        return self.count(Searcher.choose, pos, depth, ply, alpha, beta, ply)
+
+    def choose_final(self, pos, depth, alpha=-INFINITY, beta=INFINITY, count_discs=False, ply=0):
+        return self.count(Searcher.choose_final, pos, depth, ply, alpha, beta, count_discs, ply)
+
+    # Calls `search` on pos, counting the node and timing root searches.
+    # Leaves are counted by leaf_point and final_leaf_point, since
+    # choose scores most of them without a call.
+    def count(self, search, pos, depth, ply, *args):
+        stats = self.stats
+        if depth:
+            stats.nodes += 1
+        if ply:
+            return search(self, pos, depth, *args)
+        start = time.time()
+        result = search(self, pos, depth, *args)
+        stats.iterations.append((depth, time.time() - start, stats.nodes))
+        return result
+
+    def leaf_point(self, pos, alpha=-INFINITY):
+        self.stats.nodes += 1
+        self.stats.leaves += 1
+        return Searcher.leaf_point(self, pos, alpha)
+
+    def final_leaf_point(self, pos, count_discs):
+        self.stats.nodes += 1
+        self.stats.leaves += 1
+        return Searcher.final_leaf_point(self, pos, count_discs)
+
+    def calculatePoint(self, h, moves):
+        self.stats.evaluations += 1
+        return Searcher.calculatePoint(self, h, moves)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Fits the weights of patterns.PatternEvaluator to game records.
+#
+# Game records are text files with one game per line, as its moves in
+# the usual "f5d6c3..." notation (passes are left out), optionally
+# followed by other whitespace separated fields, which are ignored.
+# Every position of every game is labelled with the game's final disc
+# difference for player 1, and the pattern weights are fitted by
+# mini-batch gradient descent, either on the squared error of the
+# predicted disc difference or on the log loss of the predicted win
+# probability.
+#
+# The records are streamed: worker processes turn chunks of lines into
+# arrays of pattern indexes, a few chunks at a time, so memory stays
+# fixed however large the archive is. The games of a chunk are replayed
+# in lockstep with multiboard.
+#
+#   python train.py patterns.weights games.txt [more.txt ...] [--epochs 4]
+#
+# multiboard.py writes random games in this format.
+
+import argparse
+import itertools
+import multiprocessing
+import sys
+
+import numpy as np
+
+import multiboard
+import patterns
+from bitboard import square
+
+# Lines per task sent to a worker.
+CHUNK = 500
+
+
+# Yields the lines of the record files, one pass over all of them.
+def read_lines(paths):
+    for path in paths:
+        f = open(path)
+        try:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line
+        finally:
+            f.close()
+
+
+# Returns the squares of the moves of a record line. Raises ValueError
+# if it is not a list of moves.
+def parse_moves(line):
+    text = line.split()[0].lower()
+    moves = []
+    for i in xrange(0, len(text) - 1, 2):
+        x, y = ord(text[i]) - ord('a') + 1, int(text[i + 1])
+        if not (1 <= x <= 8 and 1 <= y <= 8):
+            raise ValueError('bad move %r' % text[i:i + 2])
+        moves.append(square(x, y))
+    return moves
+
+
+# Returns (indexes, targets) of the positions of the games in `lines`
+# with between min_empties and max_empties empty squares: the (N, 46)
+# int32 pattern indexes of each position and its game's final disc
+# difference for player 1. Games with an illegal move are skipped.
+def extract(args):
+    lines, min_empties, max_empties = args
+    games = []
+    for line in lines:
+        try:
+            moves = parse_moves(line)
+        except ValueError:
+            continue
+        if len(moves) <= 60:
+            games.append(moves)
+    n = len(games)
+    # The moves of game i are played[i], padded with -1.
+    played = np.empty((n, 60), dtype=np.int32)
+    played.fill(-1)
+    for i, moves in enumerate(games):
+        played[i, :len(moves)] = moves
+    own, opp = multiboard.initial_boards(n)
+    player = np.ones(n, dtype=np.int32)
+    legal = np.ones(n, dtype=bool)
+    # (p1, p2, game) of the positions to keep, per ply.
+    seen = []
+    for ply in xrange(max(len(moves) for moves in games) if games else 0):
+        active = np.nonzero(legal & (played[:, ply] >= 0))[0]
+        o, p, who, sq = own[active], opp[active], player[active], played[active, ply]
+        moves = multiboard.move_masks(o, p)
+        passing = moves == 0
+        o, p = np.where(passing, p, o), np.where(passing, o, p)
+        who = np.where(passing, 3 - who, who)
+        moves = np.where(passing, multiboard.move_masks(o, p), moves)
+        ok = (moves >> sq.astype(np.uint64)) & multiboard.ONE != 0
+        legal[active[~ok]] = False
+        active, o, p, who, sq = active[ok], o[ok], p[ok], who[ok], sq[ok]
+        o, p = multiboard.play(o, p, sq)
+        who = 3 - who
+        own[active], opp[active], player[active] = o, p, who
+        # Every move fills a square, so all games have 59 - ply empty
+        # squares now.
+        if min_empties <= 59 - ply <= max_empties:
+            seen.append((np.where(who == 1, o, p), np.where(who == 1, p, o), active))
+    p1, p2 = np.where(player == 1, own, opp), np.where(player == 1, opp, own)
+    # Unfinished games have no final score.
+    finished = legal & (multiboard.move_masks(p1, p2) == 0) & (multiboard.move_masks(p2, p1) == 0)
+    scores = multiboard.final_scores(p1, p2)
+    if not seen:
+        return np.zeros((0, len(patterns.INSTANCES)), dtype=np.int32), np.zeros(0)
+    game = np.concatenate([g for _, _, g in seen])
+    keep = finished[game]
+    indexes = patterns.pattern_index_array(np.concatenate([a for a, _, _ in seen])[keep],
+                                           np.concatenate([b for _, b, _ in seen])[keep])
+    return indexes, scores[game[keep]].astype(np.float64)
+
+
+# Yields (indexes, targets) batches of about `size` positions from the
+# record files, extracted by `pool`.
+def batches(pool, paths, size, min_empties, max_empties, processes):
+    lines = read_lines(paths)
+    pending_indexes, pending_targets, pending = [], [], 0
+    while True:
+        # A few chunks per worker at a time, so that the whole archive is
+        # never queued at once.
+        tasks = []
+        for i in xrange(processes * 4):
+            chunk = list(itertools.islice(lines, CHUNK))
+            if not chunk:
+                break
+            tasks.append((chunk, min_empties, max_empties))
+        if not tasks:
+            break
+        for indexes, targets in pool.imap(extract, tasks):
+            pending_indexes.append(indexes)
+            pending_targets.append(targets)
+            pending += len(targets)
+            if pending >= size:
+                indexes = np.concatenate(pending_indexes)
+                targets = np.concatenate(pending_targets)
+                for start in xrange(0, len(targets) - size + 1, size):
+                    yield indexes[start:start + size], targets[start:start + size]
+                rest = len(targets) // size * size
+                pending_indexes, pending_targets = [indexes[rest:]], [targets[rest:]]
+                pending = len(targets) - rest
+    if pending:
+        yield np.concatenate(pending_indexes), np.concatenate(pending_targets)
+
+
+# Returns the logistic function of x.
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+# One gradient step on a batch, in place. With `logistic` the weights
+# predict the log odds of a win for player 1, otherwise the disc
+# difference. Returns the batch's mean loss before the step.
+def step(weights, indexes, targets, rate, logistic):
+    score = weights[indexes].sum(axis=1)
+    if logistic:
+        predicted = sigmoid(score)
+        # Wins are 1, losses 0 and draws 1/2.
+        outcome = 0.5 + 0.5 * np.sign(targets)
+        error = outcome - predicted
+        loss = -np.mean(outcome * np.log(predicted + 1e-12) + (1 - outcome) * np.log(1 - predicted + 1e-12))
+    else:
+        error = targets - score
+        loss = np.mean(error ** 2)
+    # Every index of a position gets the position's error; bincount
+    # sums them per weight. Each weight moves by its mean error, and the
+    # step is split between the instances of a position so that its
+    # score moves by about `rate` times its error.
+    gradient = np.bincount(indexes.ravel(), np.repeat(error, indexes.shape[1]), len(weights))
+    counts = np.bincount(indexes.ravel(), None, len(weights))
+    weights += rate / indexes.shape[1] * gradient / np.maximum(counts, 1)
+    return loss
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fits pattern weights to game records.')
+    parser.add_argument('output', help='weights file to write')
+    parser.add_argument('records', nargs='+', help='game record files')
+    parser.add_argument('--epochs', type=int, default=4)
+    parser.add_argument('--batch', type=int, default=1 << 14, help='positions per step')
+    parser.add_argument('--rate', type=float, default=0.5)
+    parser.add_argument('--logistic', action='store_true', help='fit the win probability instead of the disc difference')
+    parser.add_argument('--scale', type=float, default=8.0,
+                        help='evaluation points per disc; with --logistic, per unit of log odds')
+    parser.add_argument('--min-empties', type=int, default=0)
+    parser.add_argument('--max-empties', type=int, default=59)
+    parser.add_argument('--init', help='weights file to start from')
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+
+    # Fitted in discs (or log odds) and written in evaluation points.
+    if args.init:
+        weights = patterns.PatternEvaluator.load(args.init).weights / args.scale
+    else:
+        weights = np.zeros(patterns.SIZE)
+    pool = multiprocessing.Pool(args.processes)
+    for epoch in xrange(args.epochs):
+        total, n = 0.0, 0
+        for indexes, targets in batches(pool, args.records, args.batch, args.min_empties,
+                                        args.max_empties, args.processes):
+            total += step(weights, indexes, targets, args.rate, args.logistic) * len(targets)
+            n += len(targets)
+        sys.stderr.write('epoch %d: %d positions, loss %.4f\n' % (epoch + 1, n, total / n if n else 0.0))
+    pool.close()
+    patterns.write_weights(args.output, np.clip(weights * args.scale, -32768, 32767))
+
+
+if __name__ == '__main__':
+    main()
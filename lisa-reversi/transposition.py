@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Zobrist hashing and a bounded transposition table for search.
+
+import random
+
+# Bound types of a stored score.
+EXACT = 0
+LOWER = 1  # the real score is at least the stored one (fail high)
+UPPER = 2  # the real score is at most the stored one (fail low)
+
+_random = random.Random(20161116)
+
+# ZOBRIST[player][sq] is the key of a piece of `player` on `sq`.
+ZOBRIST = [[0] * 64] + [[_random.getrandbits(64) for sq in xrange(64)] for player in (1, 2)]
+# Key xored in when player 2 plays next.
+ZOBRIST_NEXT = _random.getrandbits(64)
+
+
+# Returns the xor of the keys of the pieces of `player` in byte value
+# `b` at byte `i` of a bitboard.
+def byte_key(player, i, b):
+    key = 0
+    for bit in xrange(8):
+        if b >> bit & 1:
+            key ^= ZOBRIST[player][i * 8 + bit]
+    return key
+
+# BYTE_KEYS[player][i][b] is byte_key(player, i, b), so that a board
+# hashes in 8 lookups per player instead of one per piece.
+BYTE_KEYS = [None] + [[[byte_key(player, i, b) for b in xrange(256)] for i in xrange(8)]
+                      for player in (1, 2)]
+
+
+# Returns the Zobrist key of a bitboard.Position.
+def zobrist(pos):
+    key = ZOBRIST_NEXT if pos.next == 2 else 0
+    return key ^ zobrist_pair(pos.discs[1], pos.discs[2])
+
+
+# Returns the Zobrist key of the pair of bitboards (b1, b2) hashed as
+# the pieces of player 1 and 2, without the side to move.
+def zobrist_pair(b1, b2):
+    keys1 = BYTE_KEYS[1]
+    keys2 = BYTE_KEYS[2]
+    key = 0
+    for i in xrange(8):
+        key ^= keys1[i][b1 >> (i * 8) & 0xFF] ^ keys2[i][b2 >> (i * 8) & 0xFF]
+    return key
+
+
+# Returns the number of slots of a table of about `entries` entries.
+# One slot holds two entries, and slots are a power of two.
+def slot_count(entries):
+    slots = 1
+    while slots * 4 <= entries:
+        slots *= 2
+    return slots
+
+
+# A fixed size table of (key, depth, score, bound, move) entries.
+#
+# Each slot has two buckets: a depth-preferred one that keeps the
+# deepest search seen for the slot, and an always-replace one that
+# keeps the most recent search that did not go into the first.
+class TranspositionTable(object):
+    def __init__(self, entries=1 << 16):
+        slots = slot_count(entries)
+        self.mask = slots - 1
+        self.deep = [None] * slots
+        self.recent = [None] * slots
+
+    # Returns the entry stored for `key`, or None.
+    def probe(self, key):
+        i = key & self.mask
+        entry = self.deep[i]
+        if entry is not None and entry[0] == key:
+            return entry
+        entry = self.recent[i]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, score, bound, move):
+        i = key & self.mask
+        entry = (key, depth, score, bound, move)
+        old = self.deep[i]
+        if old is None or old[0] == key or depth >= old[1]:
+            self.deep[i] = entry
+            if old is not None and old[0] != key:
+                self.recent[i] = old
+        else:
+            self.recent[i] = entry
+
+    def clear(self):
+        slots = self.mask + 1
+        self.deep = [None] * slots
+        self.recent = [None] * slots
+
+
+# Added to scores to pack them unsigned.
+SCORE_OFFSET = 1 << 31
+
+
+# Packs everything of an entry but its key into 64 bits: the score in
+# bits 0-31, the depth in 32-39, the bound in 40-41 and the move plus
+# one (0 for None) in 42-48. Never 0, which marks an empty bucket.
+def pack(depth, score, bound, move):
+    return score + SCORE_OFFSET | depth << 32 | bound << 40 | (0 if move is None else move + 1) << 42
+
+
+def unpack(key, data):
+    move = int(data >> 42 & 0x7F) - 1
+    return (key, int(data >> 32 & 0xFF), int((data & 0xFFFFFFFF) - SCORE_OFFSET), int(data >> 40 & 3),
+            None if move < 0 else move)
+
+
+# A TranspositionTable in a flat array of 64 bit words that several
+# processes can share, such as a multiprocessing.RawArray of
+# ctypes.c_uint64 with 4 * slot_count(entries) words.
+#
+# A bucket is two words, the key xor the packed entry and the packed
+# entry. Writes take no lock: a bucket torn by two processes writing it
+# at once no longer matches its key and is just a miss.
+class SharedTranspositionTable(object):
+    def __init__(self, words):
+        self.words = words
+        self.mask = len(words) // 4 - 1
+
+    def probe(self, key):
+        words = self.words
+        i = (key & self.mask) * 4
+        data = words[i + 1]
+        if data and words[i] ^ data == key:
+            return unpack(key, data)
+        data = words[i + 3]
+        if data and words[i + 2] ^ data == key:
+            return unpack(key, data)
+        return None
+
+    def store(self, key, depth, score, bound, move):
+        words = self.words
+        i = (key & self.mask) * 4
+        data = pack(depth, score, bound, move)
+        old_data = words[i + 1]
+        old_key = words[i] ^ old_data
+        if not old_data or old_key == key or depth >= old_data >> 32 & 0xFF:
+            words[i] = key ^ data
+            words[i + 1] = data
+            if old_data and old_key != key:
+                words[i + 2] = old_key ^ old_data
+                words[i + 3] = old_data
+        else:
+            words[i + 2] = key ^ data
+            words[i + 3] = data
+
+    # ctypes is imported here, as the App Engine runtime, which never
+    # uses this table, does not have it.
+    def clear(self):
+        import ctypes
+        ctypes.memset(self.words, 0, ctypes.sizeof(self.words))